@@ -0,0 +1,439 @@
+import os
+import io
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+import pandas as pd
+from openpyxl import load_workbook
+
+import compare
+import legacy_pipeline
+import ziptxt2xlsx
+from synthetic_data import generate_dataset
+from upd_pipeline import (
+    COLUMN_SCHEMA, TARGET_HEADERS, TableAccumulator, csv_to_xlsx, extract_tables_from_files, load_abcp_report,
+    load_tnved_reference, merge_csv_files, merge_csv_preserve_headers, prepare_tables, read_table,
+    replace_missing_country,
+)
+
+COMPARE_KEY = "(номер без @ и без -)"
+COMPARE_MARK_COLUMN = "Поставщик"
+
+
+def frame_digest(df):
+    """SHA-1 значений таблицы (в строковом виде), не зависящий от типов столбцов."""
+    df = df.reset_index(drop=True)
+    text = df.astype('object').where(df.notna(), '').map(str).to_csv(index=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+# Столбцы с числами: исходная реализация хранила их в CSV с выводом типов, поэтому '9', 9.0 и '9.0' совпадают
+NUMERIC_COLUMNS = frozenset(col for col, dtype in COLUMN_SCHEMA.items() if dtype == 'float64')
+
+# Коды, которые исходная реализация теряла при чтении CSV (ведущие нули, '.0' у целых): ширина кода
+LEGACY_CODE_WIDTHS = {"2": 3, "1б": 10}
+
+
+def value_text(value):
+    """Значение ячейки без учёта типа: числа (в т.ч. строки с пробелами-разделителями) - как float, пропуск - ''."""
+    if pd.isna(value):
+        return ''
+    text = str(value)
+    try:
+        return repr(float(text.replace(' ', '')))
+    except ValueError:
+        return text
+
+
+def strict_text(value):
+    """Значение ячейки как строка, пропуск - ''."""
+    return '' if pd.isna(value) else str(value)
+
+
+def legacy_code_text(value, width):
+    """Код из выхода исходной реализации в исходной записи: без '.0' и с ведущими нулями до width."""
+    text = strict_text(value)
+    if text.endswith('.0') and text[:-2].isdigit():
+        text = text[:-2]
+    return text.zfill(width) if text.isdigit() else text
+
+
+def values_digest(df, legacy=False):
+    """
+    SHA-1 значений таблицы для сверки с исходной реализацией (legacy_pipeline).
+
+    Числовые столбцы (NUMERIC_COLUMNS) сравниваются без учёта типа, остальные - строго
+    как строки: '006' и '6' различаются. С legacy=True коды LEGACY_CODE_WIDTHS из выхода
+    исходной реализации приводятся к исходной записи, прочие её потери не прощаются.
+    """
+    df = df.reset_index(drop=True).astype('object')
+    columns = {}
+    for col in df.columns:
+        if col in NUMERIC_COLUMNS:
+            columns[col] = df[col].map(value_text)
+        elif legacy and col in LEGACY_CODE_WIDTHS:
+            columns[col] = df[col].map(lambda value, width=LEGACY_CODE_WIDTHS[col]: legacy_code_text(value, width))
+        else:
+            columns[col] = df[col].map(strict_text)
+    text = pd.DataFrame(columns, columns=df.columns).to_csv(index=False)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def extracted_values_digest(tables):
+    """Значения извлечённых таблиц в столбцах TARGET_HEADERS (без столбцов, добавляемых сборкой)."""
+    if not tables:
+        return values_digest(pd.DataFrame(columns=TARGET_HEADERS))
+    return values_digest(pd.concat(tables, ignore_index=True).reindex(columns=TARGET_HEADERS))
+
+
+def csv_values_digest(path):
+    """Значения CSV исходной реализации - как текст, без вывода типов."""
+    return values_digest(pd.read_csv(path, dtype=object), legacy=True)
+
+
+def workbook_values_digest(path, legacy=False):
+    return values_digest(pd.read_excel(path, dtype=object), legacy=legacy)
+
+
+def table_digest(path):
+    """Содержимое CSV/Parquet/Feather так, как его читает следующий этап (с типами COLUMN_SCHEMA)."""
+    return frame_digest(read_table(path, dtype={0: 'object', 1: 'object'}, schema=COLUMN_SCHEMA))
+
+
+def workbook_digest(paths, fills=False):
+    """
+    Значения всех листов книг (по порядку) и, если fills, координаты всех залитых ячеек.
+    Оформление заголовка и ширины столбцов не учитываются.
+    """
+    digest = hashlib.sha1()
+    for path in sorted(paths, key=lambda p: (len(p), p)):
+        for name, df in pd.read_excel(path, sheet_name=None, dtype=str).items():
+            digest.update(name.encode('utf-8'))
+            digest.update(frame_digest(df).encode('ascii'))
+        if fills:
+            wb = load_workbook(path, read_only=True)
+            for ws in wb:
+                marked = [cell.coordinate for row in ws.iter_rows(min_row=2) for cell in row
+                          if getattr(cell, 'fill', None) is not None and cell.fill.fill_type]
+                digest.update(",".join(marked).encode('ascii'))
+            wb.close()
+    return digest.hexdigest()
+
+
+class StageRunner:
+    """
+    Прогон этапов с замером времени, строк в секунду и пика памяти (tracemalloc).
+
+    Пик памяти учитывает только текущий процесс: для этапов с пулом процессов
+    память дочерних процессов не видна. tracemalloc замедляет выполнение,
+    для чистого времени его можно отключить (memory=False).
+    """
+
+    def __init__(self, scale, memory=True, verbose=False):
+        self.scale = scale
+        self.memory = memory
+        self.verbose = verbose
+        self.results = []
+        self.digests = {}
+
+    def run(self, stage, func, rows=None, reference=None, digest=None, values=None):
+        """
+        Выполняет func() как этап stage.
+
+        rows: число строк (или функция от результата) для rows/s;
+        digest: функция от результата, дающая отпечаток выхода;
+        reference: этап, с выходом которого отпечаток должен совпасть;
+        values: функция от результата, дающая отпечаток значений без учёта типов
+            (сохраняется как "<stage>/values" для сверки с исходной реализацией).
+        """
+        if self.memory:
+            tracemalloc.start()
+        output = io.StringIO()
+        start = time.perf_counter()
+        if self.verbose:
+            result = func()
+        else:
+            with redirect_stdout(output):
+                result = func()
+        elapsed = time.perf_counter() - start
+        peak = None
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        row_count = rows(result) if callable(rows) else rows
+        record = {
+            "scale": self.scale,
+            "stage": stage,
+            "seconds": round(elapsed, 4),
+            "rows": row_count,
+            "rows_per_second": round(row_count / elapsed, 1) if row_count and elapsed else None,
+            "peak_memory_mb": round(peak / 2 ** 20, 2) if peak is not None else None,
+            "digest": None,
+            "check": None,
+        }
+        if values:
+            self.digests[f"{stage}/values"] = values(result)
+        if digest:
+            record["digest"] = self.digests[stage] = digest(result)
+            if reference:
+                record["check"] = "ok" if self.digests.get(reference) == record["digest"] else f"differs from {reference}"
+        self.results.append(record)
+        return result
+
+
+def run_pipeline_stages(runner, dataset, work_dir, jobs=0):
+    """
+    Этапы main_*.py на наборе dataset: текущий путь, его альтернативные варианты
+    и исходная реализация (legacy_pipeline, этапы *_baseline) для сверки значений.
+    """
+    files = sorted(dataset["upd_files"])
+
+    extracted_tables = lambda results: [t for _, tables, _, _ in results for t in tables]
+    extracted_digest = lambda results: frame_digest(prepare_tables(extracted_tables(results)))
+    row_count = lambda results: sum(len(t) for _, tables, _, _ in results for t in tables)
+
+    results = runner.run("extract", lambda: list(extract_tables_from_files(files)),
+                         rows=row_count, digest=extracted_digest,
+                         values=lambda results: extracted_values_digest(extracted_tables(results)))
+    runner.run("extract_streaming", lambda: list(extract_tables_from_files(files, streaming=True)),
+               rows=row_count, digest=extracted_digest, reference="extract")
+    runner.run("extract_parallel", lambda: list(extract_tables_from_files(files, jobs=jobs)),
+               rows=row_count, digest=extracted_digest, reference="extract")
+    tables = extracted_tables(results)
+    total_rows = sum(len(table) for table in tables)
+
+    legacy_tables = runner.run(
+        "extract_baseline", lambda: [table for file in files for table in legacy_pipeline.find_and_extract_tables(file)],
+        rows=lambda tables: sum(len(t) for t in tables), digest=extracted_values_digest, reference="extract/values")
+
+    # Сборка промежуточного файла: накопитель и исходный путь save_to_csv + merge_csv_by_headers
+    target_path = os.path.join(work_dir, "main_bench.csv")
+    legacy_path = os.path.join(work_dir, "main_legacy.csv")
+    target_values = lambda _: values_digest(read_table(target_path, schema=COLUMN_SCHEMA))
+    legacy_values = lambda _: csv_values_digest(legacy_path)
+
+    def accumulate():
+        accumulator = TableAccumulator(target_path)
+        for table in tables:
+            accumulator.add(table)
+        return accumulator.finalize()
+
+    def merge_baseline():
+        temp_path = os.path.join(work_dir, "temp_data_file.csv")
+        pd.DataFrame(columns=legacy_pipeline.COLUMN_ORDER).to_csv(legacy_path, index=False, encoding='utf-8-sig')
+        for table in legacy_tables:
+            legacy_pipeline.save_to_csv(table, temp_path)
+            legacy_pipeline.merge_csv_by_headers(temp_path, legacy_path)
+        return legacy_path
+
+    runner.run("accumulate", accumulate, rows=total_rows, digest=table_digest, values=target_values)
+    runner.run("merge_baseline", merge_baseline, rows=total_rows, digest=legacy_values,
+               reference="accumulate/values")
+
+    # ТН ВЭД: индекс справочника и исходный путь через CSV справочника
+    runner.run("tnved", lambda: merge_csv_preserve_headers(
+        target_path, None, target_path, value_index=load_tnved_reference(dataset["tnved_folder"])),
+               rows=total_rows, digest=lambda _: table_digest(target_path), values=target_values)
+    runner.run("tnved_baseline", lambda: legacy_pipeline.merge_csv_preserve_headers(
+        legacy_path, legacy_pipeline.xlsx_to_csv(dataset["tnved_path"], os.path.join(work_dir, "tnved.csv")),
+        legacy_path),
+               rows=total_rows, digest=legacy_values, reference="tnved/values")
+
+    runner.run("country", lambda: replace_missing_country(target_path, "10а", "РОССИЯ"), rows=total_rows,
+               digest=lambda _: table_digest(target_path), values=target_values)
+    runner.run("country_baseline", lambda: legacy_pipeline.replace_missing_country(legacy_path, "10а", "РОССИЯ"),
+               rows=total_rows, digest=legacy_values, reference="country/values")
+
+    # ABCP: отчёт напрямую и исходный путь через CSV отчёта
+    runner.run("abcp", lambda: merge_csv_files(target_path, dataset["report_path"],
+                                               report_df=load_abcp_report(dataset["report_path"])),
+               rows=total_rows, digest=lambda _: table_digest(target_path), values=target_values)
+    runner.run("abcp_baseline", lambda: legacy_pipeline.merge_csv_files(
+        legacy_path, legacy_pipeline.xls_to_csv(dataset["report_path"], os.path.join(work_dir, "report.csv"))),
+               rows=total_rows, digest=legacy_values, reference="abcp/values")
+
+    xlsx_path = os.path.join(work_dir, "main_bench.xlsx")
+    runner.run("export", lambda: csv_to_xlsx(target_path, xlsx_path), rows=total_rows,
+               digest=lambda path: workbook_digest([path]), values=workbook_values_digest)
+    runner.run("export_fast", lambda: csv_to_xlsx(target_path, os.path.join(work_dir, "main_fast.xlsx"),
+                                                  write_only=True),
+               rows=total_rows, digest=lambda path: workbook_digest([path]), reference="export")
+    runner.run("export_baseline", lambda: legacy_pipeline.csv_to_xlsx(legacy_path,
+                                                                      os.path.join(work_dir, "main_legacy.xlsx")),
+               rows=total_rows, digest=lambda path: workbook_values_digest(path, legacy=True),
+               reference="export/values")
+    return xlsx_path
+
+
+def run_compare_stages(runner, xlsx_path, work_dir, chunksize=50000):
+    """compare.py: два пересекающихся среза итогового файла, подсветка тремя способами и отчёт о расхождениях."""
+    df = pd.read_excel(xlsx_path)
+    cut = len(df) * 2 // 5
+    file1_path = os.path.join(work_dir, "compare_1.xlsx")
+    file2_path = os.path.join(work_dir, "compare_2.xlsx")
+    df.iloc[:len(df) - cut].to_excel(file1_path, index=False)
+    df.iloc[cut:].to_excel(file2_path, index=False)
+    total_rows = len(df) - cut + (len(df) - cut)
+
+    def color(output_name, **kwargs):
+        # Исходный путь пишет временную книгу temp_<output_path>, поэтому имя - относительно рабочей папки
+        compare.merge_and_color_excel_files(file1_path, file2_path, COMPARE_MARK_COLUMN, COMPARE_KEY, output_name,
+                                            "compare_2.xlsx", **kwargs)
+        return os.path.join(work_dir, output_name)
+
+    def color_streaming():
+        output_path = os.path.join(work_dir, "compare_streaming.xlsx")
+        compare.merge_and_color_streaming(file1_path, file2_path, COMPARE_MARK_COLUMN, COMPARE_KEY, output_path,
+                                          "compare_2.xlsx", chunksize=chunksize)
+        return output_path
+
+    colored_digest = lambda path: workbook_digest([path], fills=True)
+    runner.run("compare", lambda: color("compare.xlsx"), rows=total_rows, digest=colored_digest)
+    runner.run("compare_single_pass", lambda: color("compare_single.xlsx", single_pass=True), rows=total_rows,
+               digest=colored_digest, reference="compare")
+    runner.run("compare_streaming", color_streaming, rows=total_rows, digest=colored_digest, reference="compare")
+    runner.run("compare_diff", lambda: compare.diff_excel_files(file1_path, file2_path, COMPARE_KEY,
+                                                                os.path.join(work_dir, "diff.xlsx")),
+               rows=total_rows, digest=lambda _: workbook_digest([os.path.join(work_dir, "diff.xlsx")]))
+
+
+def run_ziptxt_stages(runner, zip_path, work_dir, total_rows):
+    """ziptxt2xlsx: обычная и потоковая запись xlsx, csv.gz и Parquet."""
+
+    def convert(name, **kwargs):
+        output_dir = os.path.join(work_dir, name)
+        os.makedirs(output_dir, exist_ok=True)
+        return ziptxt2xlsx.convert_zip(zip_path, output_dir, **kwargs)
+
+    runner.run("ziptxt", lambda: convert("zip_xlsx"), rows=total_rows, digest=workbook_digest)
+    runner.run("ziptxt_streaming", lambda: convert("zip_streaming", streaming=True), rows=total_rows,
+               digest=workbook_digest, reference="ziptxt")
+    runner.run("ziptxt_csv", lambda: convert("zip_csv", output_format='csv.gz'), rows=total_rows,
+               digest=workbook_digest_like_csv, reference="ziptxt")
+    runner.run("ziptxt_parquet", lambda: convert("zip_parquet", output_format='parquet'), rows=total_rows,
+               digest=lambda paths: hashlib.sha1("".join(frame_digest(pd.read_parquet(path))
+                                                          for path in paths).encode('ascii')).hexdigest())
+
+
+def workbook_digest_like_csv(paths):
+    """Отпечаток csv.gz-выгрузок в той же форме, что workbook_digest для листов xlsx с теми же именами."""
+    digest = hashlib.sha1()
+    for path in sorted(paths, key=lambda p: (len(p), p)):
+        sheet = os.path.basename(path)[:-len('.csv.gz')].split('.', 1)[1]
+        digest.update(sheet.encode('utf-8'))
+        digest.update(frame_digest(pd.read_csv(path, dtype=str, keep_default_na=False)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def run_benchmark(scales, work_root, tables=2, rows_per_table=50, zip_lines_per_row=5, jobs=0, memory=True,
+                  verbose=False, seed=0):
+    """
+    Генерирует набор данных для каждого масштаба (число файлов УПД) и прогоняет все этапы.
+
+    Возвращает:
+    tuple: (список результатов по этапам, {масштаб: {этап: отпечаток выхода}})
+    """
+    all_results, digests = [], {}
+    cwd = os.getcwd()
+
+    for n_files in scales:
+        work_dir = os.path.join(work_root, f"files_{n_files}")
+        # Накопитель дописывает к существующему файлу, поэтому папка масштаба всегда создаётся заново
+        shutil.rmtree(work_dir, ignore_errors=True)
+        zip_lines = n_files * tables * rows_per_table * zip_lines_per_row
+        dataset = generate_dataset(work_dir, n_files, tables, rows_per_table, zip_lines, zip_members=2, seed=seed)
+        if not any(path.lower().endswith('.xls') for path in dataset["upd_files"]):
+            print(f"⚠ files_{n_files}: в наборе нет УПД в формате xls (xlwt не установлен или файлов меньше 3) - "
+                  f"чтение xls через xlrd не измерено и не сверено")
+        runner = StageRunner(f"files_{n_files}", memory=memory, verbose=verbose)
+
+        # Кеши справочников (.cache) создаются в рабочей папке масштаба
+        os.chdir(work_dir)
+        try:
+            xlsx_path = run_pipeline_stages(runner, dataset, work_dir, jobs)
+            run_compare_stages(runner, xlsx_path, work_dir)
+            run_ziptxt_stages(runner, dataset["zip_path"], work_dir, zip_lines * 2)
+        finally:
+            os.chdir(cwd)
+
+        all_results.extend(runner.results)
+        digests[runner.scale] = runner.digests
+
+    return all_results, digests
+
+
+def check_baseline(digests, baseline):
+    """Сравнивает отпечатки выходов с сохранёнными ранее; возвращает список расхождений."""
+    mismatches = []
+    for scale, stages in digests.items():
+        for stage, digest in stages.items():
+            expected = baseline.get(scale, {}).get(stage)
+            if expected is not None and expected != digest:
+                mismatches.append(f"{scale}/{stage}")
+    return mismatches
+
+
+def print_report(results):
+    header = f"{'масштаб':<12} {'этап':<22} {'сек':>9} {'строк':>9} {'строк/с':>11} {'пик МБ':>9}  проверка"
+    print(header)
+    print("-" * len(header))
+    for record in results:
+        rate = f"{record['rows_per_second']:.0f}" if record["rows_per_second"] else "-"
+        peak = f"{record['peak_memory_mb']:.1f}" if record["peak_memory_mb"] is not None else "-"
+        print(f"{record['scale']:<12} {record['stage']:<22} {record['seconds']:>9.3f} {record['rows'] or '-':>9} "
+              f"{rate:>11} {peak:>9}  {record['check'] or ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов пайплайна УПД, compare.py и ziptxt2xlsx "
+                                                 "на синтетических данных")
+    parser.add_argument("--scales", default="10,50,200", help="Масштабы - количество файлов УПД через запятую")
+    parser.add_argument("--tables", type=int, default=2, help="Таблиц товаров в файле")
+    parser.add_argument("--rows", type=int, default=50, help="Строк в таблице")
+    parser.add_argument("--zip-lines-per-row", type=int, default=5,
+                        help="Строк txt-выгрузки на строку УПД (размер zip растёт вместе с масштабом)")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="Процессов для extract_parallel (0 - по числу ядер)")
+    parser.add_argument("--no-memory", action="store_true", help="Не замерять пик памяти (tracemalloc замедляет этапы)")
+    parser.add_argument("--workdir", default=None, help="Папка для данных (по умолчанию - временная, удаляется)")
+    parser.add_argument("--json", default=None, help="Сохранить результаты в JSON")
+    parser.add_argument("--save-baseline", default=None, help="Сохранить отпечатки выходов как эталон")
+    parser.add_argument("--baseline", default=None, help="Сверить отпечатки выходов с эталоном")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-v", "--verbose", action="store_true", help="Не скрывать вывод этапов")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+    work_root = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="upd_bench_"))
+
+    try:
+        results, digests = run_benchmark(scales, work_root, args.tables, args.rows, args.zip_lines_per_row,
+                                         args.jobs, memory=not args.no_memory, verbose=args.verbose, seed=args.seed)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print_report(results)
+    failed = [f"{r['scale']}/{r['stage']}" for r in results if r["check"] not in (None, "ok")]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"results": results, "digests": digests}, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(digests, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failed += [f"{name} (эталон)" for name in check_baseline(digests, json.load(f))]
+
+    if failed:
+        print(f"❌ Выходы отличаются: {', '.join(failed)}")
+        raise SystemExit(1)
+    print("✅ Выходы совпадают")
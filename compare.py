@@ -1,25 +1,221 @@
+import os
+import argparse
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import PatternFill
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from run_report import StageProfiler, profiled
+from upd_pipeline import excel_cell_value, normalize_keys, read_table, table_format, write_table
+from xlsx_writer import RolloverSheets
 
-def merge_and_color_excel_files(file1_path, file2_path, column_one, column_two, output_path, col_mark):
-    # Загрузка данных из файлов
-    if file1_path.lower().endswith('.xls'):
-        df1 = [pd.read_excel(file1_path, engine='xlrd')]
-    elif file1_path.lower().endswith('xlsx'):
-        df1 = pd.read_excel(file1_path)
+# Листы отчёта о расхождениях
+DIFF_SHEETS = {
+    "only_in_1": "Только в 1",
+    "only_in_2": "Только в 2",
+    "matched": "Совпадения",
+    "changes": "Изменения",
+    "ambiguous": "Неоднозначные",
+}
+
+# Столбцы, уточняющие пару при повторяющемся ключе: документ об отгрузке и продавец (реквизиты УПД)
+DISAMBIGUATION_COLUMNS = ["(5а)", "(2)"]
+
+
+def read_spreadsheet(file_path):
+    """Читает xls (xlrd), xlsx (openpyxl), а также CSV/Parquet/Feather в DataFrame."""
+    if file_path.lower().endswith('.xls'):
+        return pd.read_excel(file_path, engine='xlrd')
+    if file_path.lower().endswith(('.csv', '.parquet', '.feather')):
+        return read_table(file_path)
+    return pd.read_excel(file_path)
+
+
+def iter_spreadsheet_chunks(file_path, chunksize=50000, columns=None, dtype=None):
+    """
+    Читает файл порциями по chunksize строк, не загружая его целиком.
+
+    CSV и Parquet читаются штатными потоковыми читателями, xlsx - построчно
+    через openpyxl read-only. xls и Feather читаются целиком и нарезаются.
+    Всегда возвращает хотя бы одну (возможно, пустую) порцию со столбцами файла.
+    dtype (как в pd.read_csv) задаёт типы столбцов CSV: без него типы выводятся
+    для каждой порции отдельно (например, числовой ключ становится float в порции с пропуском).
+    """
+    lower = file_path.lower()
+    yielded = False
+
+    if lower.endswith('.csv'):
+        for chunk in pd.read_csv(file_path, chunksize=chunksize, usecols=columns, dtype=dtype):
+            yielded = True
+            yield chunk
+        if not yielded:
+            yield pd.read_csv(file_path, nrows=0, usecols=columns, dtype=dtype)
+
+    elif lower.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(file_path)
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yielded = True
+            yield batch.to_pandas()
+        if not yielded:
+            yield parquet_file.schema_arrow.empty_table().to_pandas()[columns or slice(None)]
+
+    elif lower.endswith('.xlsx'):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            header = [f"Unnamed: {idx}" if name is None else name for idx, name in enumerate(next(rows, ()))]
+            buffer = []
+            for row in rows:
+                values = [excel_cell_value(cell) for cell in row[:len(header)]]
+                if all(pd.isna(value) for value in values):
+                    continue  # Пустые строки pd.read_excel тоже пропускает
+                buffer.append(values + [None] * (len(header) - len(values)))
+                if len(buffer) >= chunksize:
+                    yielded = True
+                    chunk = pd.DataFrame(buffer, columns=header, dtype='object')
+                    yield chunk[columns] if columns else chunk
+                    buffer = []
+            if buffer or not yielded:
+                chunk = pd.DataFrame(buffer, columns=header, dtype='object')
+                yield chunk[columns] if columns else chunk
+        finally:
+            wb.close()
+
+    else:
+        df = read_spreadsheet(file_path)
+        if columns:
+            df = df[columns]
+        for start in range(0, max(len(df), 1), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+
+class HighlightedWriter:
+    """
+    Потоковая запись строк с подсветкой совпадений.
+
+    xlsx - write-only книга, совпавшие строки заливаются при записи целиком,
+    включая _source (как в merge_and_color_excel_files: обращение к ячейке после
+    _source добавляет пустой столбец, и срез [:-1] отбрасывает только его), после
+    EXCEL_MAX_ROWS строк начинается новый лист. csv - дозапись порций
+    с признаком совпадения в столбце _match.
+    """
+
+    def __init__(self, output_path, columns, fill):
+        self.output_path = output_path
+        self.columns = list(columns)
+        self.fill = fill
+        self.is_excel = output_path.lower().endswith('.xlsx')
+        self.rows_written = 0
+        self.header_written = False
+        if self.is_excel:
+            self.wb = Workbook(write_only=True)
+            self.sheets = RolloverSheets(self.columns, self.wb)
+
+    def write(self, df, highlight_mask):
+        df = df.reindex(columns=self.columns)
+        if not self.is_excel:
+            df = df.assign(_match=highlight_mask)
+            df.to_csv(self.output_path, mode='a' if self.header_written else 'w',
+                      header=not self.header_written, index=False, encoding='utf-8-sig')
+            self.header_written = True
+            self.rows_written += len(df)
+            return
+
+        values = df.astype('object').where(df.notna(), None)
+        for row, highlight in zip(values.itertuples(index=False, name=None), highlight_mask):
+            self.sheets.append(row, fill=self.fill if highlight else None)
+        self.rows_written += len(df)
+
+    def close(self):
+        if self.is_excel:
+            self.sheets.close()
+            self.wb.save(self.output_path)
+        elif not self.header_written:
+            pd.DataFrame(columns=self.columns + ['_match']).to_csv(self.output_path, index=False,
+                                                                    encoding='utf-8-sig')
+        return self.output_path
+
+
+def write_highlighted_excel(df, highlight_mask, output_path, fill):
+    """
+    Записывает DataFrame в xlsx за один проход (write-only книга), заливая
+    строки, отмеченные в highlight_mask, прямо при записи.
+    """
+    writer = HighlightedWriter(output_path, df.columns, fill)
+    writer.write(df, highlight_mask)
+    return writer.close()
+
+
+def non_empty_rows(df, column):
+    """Маска строк, где столбец не пустой и не NaN."""
+    return df[column].notna() & (df[column] != '')
+
+
+def match_mask(values, new_values):
+    """Маска значений, строковое представление которых входит в new_values."""
+    return (values.notna() & values.map(str).isin(new_values)).to_numpy()
+
+
+def merge_and_color_streaming(file1_path, file2_path, column_one, column_two, output_path, col_mark,
+                              chunksize=50000):
+    """
+    Потоковый вариант merge_and_color_excel_files для очень больших файлов.
+
+    Сначала по файлу 2 строится множество значений column_two (читаются только
+    column_one и column_two), затем файл 1 и строки файла 2 с непустым column_one
+    читаются порциями, помечаются и сразу дописываются в результат.
+    Пиковая память ограничена множеством ключей и одной порцией данных.
+    Входы: xls/xlsx/csv/parquet/feather; результат: xlsx (с заливкой) или csv (столбец _match).
+    """
+    # Ключевые столбцы CSV читаются строками, чтобы все порции и оба файла давали одинаковые ключи
+    key_dtype = {column_one: 'object', column_two: 'object'}
+
+    # 1. Множество ключей из файла 2
+    new_values = set()
+    for chunk in iter_spreadsheet_chunks(file2_path, chunksize, columns=[column_one, column_two], dtype=key_dtype):
+        new_values.update(chunk.loc[non_empty_rows(chunk, column_one), column_two].dropna().astype(str))
+
+    # 2. Столбцы результата - как у pd.concat([df1, new_rows])
+    columns_1 = list(next(iter_spreadsheet_chunks(file1_path, 1)).columns)
+    columns_2 = list(next(iter_spreadsheet_chunks(file2_path, 1)).columns)
+    columns = columns_1 + [col for col in columns_2 + ['_source'] if col not in columns_1]
+
+    yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+    writer = HighlightedWriter(output_path, columns, yellow_fill)
+
+    # 3. Файл 1 порциями
+    for chunk in iter_spreadsheet_chunks(file1_path, chunksize, dtype=key_dtype):
+        writer.write(chunk, match_mask(chunk[column_two], new_values))
+
+    # 4. Строки файла 2 с непустым column_one
+    for chunk in iter_spreadsheet_chunks(file2_path, chunksize, dtype=key_dtype):
+        new_rows = chunk[non_empty_rows(chunk, column_one)].copy()
+        new_rows['_source'] = col_mark
+        writer.write(new_rows, match_mask(new_rows[column_two], new_values))
 
+    print(f"Записано {writer.rows_written} строк в {output_path}, ключей из {file2_path}: {len(new_values)}")
+    return writer.close()
 
-    if file2_path.lower().endswith('.xls'):
-        df2 = [pd.read_excel(file2_path, engine='xlrd')]
-    elif file2_path.lower().endswith('xlsx'):
-        df2 = pd.read_excel(file2_path)
+
+def merge_and_color_excel_files(file1_path, file2_path, column_one, column_two, output_path, col_mark,
+                                single_pass=False):
+    """
+    Дописывает к файлу 1 строки файла 2 с непустым column_one и заливает
+    жёлтым строки, у которых значение column_two встречается среди этих строк.
+
+    single_pass=True: маска совпадений считается векторно, результат пишется
+    один раз с заливкой при записи (без временного файла и повторной загрузки).
+    """
+    # Загрузка данных из файлов
+    df1 = read_spreadsheet(file1_path)
+    df2 = read_spreadsheet(file2_path)
 
     # Находим строки из файла2, где столбец "один" не пустой и не NaN
-    non_empty_mask = df2[column_one].notna() & (df2[column_one] != '')
-    new_rows = df2[non_empty_mask].copy()
+    new_rows = df2[non_empty_rows(df2, column_one)].copy()
 
     # Добавляем метку для строк из файла2
     new_rows['_source'] = col_mark
@@ -27,6 +223,15 @@ def merge_and_color_excel_files(file1_path, file2_path, column_one, column_two,
     # Объединяем данные
     merged_df = pd.concat([df1, new_rows], ignore_index=True)
 
+    yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
+
+    if single_pass:
+        # Совпадения по столбцу "два" - одной векторной операцией
+        new_values = set(new_rows[column_two].dropna().astype(str))
+        highlight_mask = match_mask(merged_df[column_two], new_values)
+        write_highlighted_excel(merged_df, highlight_mask, output_path, yellow_fill)
+        return
+
     # Сохраняем объединенные данные во временный файл
     temp_output = "temp_" + output_path
     merged_df.to_excel(temp_output, index=False)
@@ -36,7 +241,6 @@ def merge_and_color_excel_files(file1_path, file2_path, column_one, column_two,
     ws = wb.active
 
     # Создаем стили
-    yellow_fill = PatternFill(start_color='FFFF00', end_color='FFFF00', fill_type='solid')
     green_fill = PatternFill(start_color='00FF00', end_color='00FF00', fill_type='solid')
 
     # Получаем список значений из столбца "два" в новых строках
@@ -69,16 +273,188 @@ def merge_and_color_excel_files(file1_path, file2_path, column_one, column_two,
     os.remove(temp_output)
 
 
+def compare_by_key(df1, df2, key_column, columns=None, match_columns=None):
+    """
+    Сравнивает две таблицы по нормализованному ключу (strip + lower) через хеш-соединение.
+
+    Пары строятся в два шага:
+    1. Полностью совпадающие строки (ключ и все сравниваемые столбцы). Такие строки
+       неразличимы, поэтому их повторы сопоставляются по порядку.
+    2. Остальные - по ключу и match_columns (по умолчанию - DISAMBIGUATION_COLUMNS,
+       общие для обеих таблиц), если комбинация встречается ровно один раз в каждом файле.
+       Повторяющиеся комбинации не сопоставляются наугад, а попадают в 'ambiguous'.
+    Строки без ключа не сопоставляются.
+
+    Параметры:
+    df1, df2 (pd.DataFrame): Сравниваемые таблицы
+    key_column (str): Столбец ключа (должен быть в обеих таблицах)
+    columns (list): Сравниваемые столбцы (по умолчанию - общие для обеих таблиц)
+    match_columns (list): Столбцы, уточняющие пару при повторяющемся ключе
+
+    Возвращает:
+    dict: 'only_in_1', 'only_in_2' - строки без пары; 'matched' - строки файла 1 с парой
+          и числом/списком отличий; 'changes' - по строке на каждое отличие;
+          'ambiguous' - строки с неоднозначной парой (столбец 'Файл' - 1 или 2)
+    """
+    if columns is None:
+        columns = [col for col in df1.columns if col in df2.columns and col != key_column]
+    if match_columns is None:
+        match_columns = [col for col in DISAMBIGUATION_COLUMNS
+                         if col in df1.columns and col in df2.columns and col != key_column]
+
+    def keyed(df, rows, cols):
+        # Сравнение по object: категориальные столбцы (COLUMN_SCHEMA) с разными наборами категорий не сравниваются
+        part = df.iloc[rows]
+        frame = pd.DataFrame({"_key": normalize_keys(part[key_column]).to_numpy(dtype=object), "_row": rows})
+        for idx, col in enumerate(cols):
+            values = part[col].astype('object')
+            frame[f"_c{idx}"] = values.where(values.notna(), None).to_numpy()
+        return frame[frame["_key"] != ""]
+
+    def unpaired(df, paired):
+        rows = np.ones(len(df), dtype=bool)
+        rows[paired] = False
+        return np.flatnonzero(rows)
+
+    # Шаг 1: полностью совпадающие строки
+    exact_1 = keyed(df1, np.arange(len(df1)), columns)
+    exact_2 = keyed(df2, np.arange(len(df2)), columns)
+    on = list(exact_1.columns.drop("_row"))
+    for frame in (exact_1, exact_2):
+        frame["_occurrence"] = frame.groupby(on, dropna=False).cumcount()
+    exact = exact_1.merge(exact_2, on=on + ["_occurrence"], how="inner", suffixes=("_1", "_2"))
+
+    # Шаг 2: ключ + уточняющие столбцы, только однозначные пары
+    rest_1 = keyed(df1, unpaired(df1, exact["_row_1"].to_numpy()), match_columns)
+    rest_2 = keyed(df2, unpaired(df2, exact["_row_2"].to_numpy()), match_columns)
+    on = list(rest_1.columns.drop("_row"))
+    for frame in (rest_1, rest_2):
+        frame["_count"] = frame.groupby(on, dropna=False)["_row"].transform("size")
+    candidates = rest_1.merge(rest_2, on=on, how="inner", suffixes=("_1", "_2"))
+    unique = (candidates["_count_1"] == 1) & (candidates["_count_2"] == 1)
+    ambiguous_rows_1 = np.unique(candidates.loc[~unique, "_row_1"].to_numpy())
+    ambiguous_rows_2 = np.unique(candidates.loc[~unique, "_row_2"].to_numpy())
+
+    pairs = pd.concat([exact[["_row_1", "_row_2"]], candidates.loc[unique, ["_row_1", "_row_2"]]])
+    pairs = pairs.sort_values("_row_1", kind='stable').reset_index(drop=True)
+    rows_1 = pairs["_row_1"].to_numpy()
+    rows_2 = pairs["_row_2"].to_numpy()
+
+    only_in_1 = df1.iloc[unpaired(df1, np.concatenate([rows_1, ambiguous_rows_1]).astype(int))]
+    only_in_2 = df2.iloc[unpaired(df2, np.concatenate([rows_2, ambiguous_rows_2]).astype(int))]
+
+    ambiguous = pd.concat([df1.iloc[ambiguous_rows_1].assign(_key=normalize_keys(df1[key_column].iloc[ambiguous_rows_1]).to_numpy()),
+                           df2.iloc[ambiguous_rows_2].assign(_key=normalize_keys(df2[key_column].iloc[ambiguous_rows_2]).to_numpy())],
+                          keys=[1, 2], names=["Файл", None]).reset_index(level=0)
+    ambiguous = ambiguous.sort_values("_key", kind='stable').drop(columns="_key").reset_index(drop=True)
+
+    # Отличия по каждому столбцу - векторно для всех пар сразу
+    changes = []
+    diff_count = pd.Series(0, index=range(len(pairs)))
+    diff_columns = [[] for _ in range(len(pairs))]
+    for col in columns:
+        # Сравнение по object: категориальные столбцы (COLUMN_SCHEMA) с разными наборами категорий не сравниваются
+        value_1 = df1[col].iloc[rows_1].reset_index(drop=True).astype('object')
+        value_2 = df2[col].iloc[rows_2].reset_index(drop=True).astype('object')
+        differs = ~((value_1 == value_2) | (value_1.isna() & value_2.isna()))
+        if not differs.any():
+            continue
+        diff_count += differs.astype(int)
+        for pair_idx in differs[differs].index:
+            diff_columns[pair_idx].append(str(col))
+        changes.append(pd.DataFrame({
+            key_column: df1[key_column].iloc[rows_1].reset_index(drop=True)[differs],
+            "Столбец": col,
+            "Значение 1": value_1[differs],
+            "Значение 2": value_2[differs],
+        }))
+
+    matched = df1.iloc[rows_1].reset_index(drop=True)
+    matched["Отличий"] = diff_count.to_numpy()
+    matched["Отличающиеся столбцы"] = [", ".join(names) for names in diff_columns]
+
+    changes = (pd.concat(changes).sort_index(kind='stable').reset_index(drop=True) if changes
+               else pd.DataFrame(columns=[key_column, "Столбец", "Значение 1", "Значение 2"]))
+
+    return {"only_in_1": only_in_1, "only_in_2": only_in_2, "matched": matched, "changes": changes,
+            "ambiguous": ambiguous}
+
+
+def write_diff_report(report, output_path):
+    """
+    Записывает отчёт compare_by_key: xlsx - многолистовая книга,
+    parquet/feather/csv - по файлу на категорию (<имя>.<категория>.<расширение>).
+    """
+    if output_path.lower().endswith('.xlsx'):
+        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
+            for name, sheet_name in DIFF_SHEETS.items():
+                report[name].to_excel(writer, sheet_name=sheet_name, index=False)
+        return [output_path]
+
+    base_path, ext = os.path.splitext(output_path)
+    if table_format(output_path) == 'csv' and ext.lower() != '.csv':
+        raise ValueError(f"Неподдерживаемый формат отчёта: {output_path}")
+    return [write_table(report[name], f"{base_path}.{name}{ext}") for name in DIFF_SHEETS]
+
+
+def diff_excel_files(file1_path, file2_path, key_column, output_path, columns=None):
+    """Сравнивает два файла по ключу и записывает отчёт о расхождениях."""
+    df1 = read_spreadsheet(file1_path)
+    df2 = read_spreadsheet(file2_path)
+
+    report = compare_by_key(df1, df2, key_column, columns)
+    changed_rows = int((report["matched"]["Отличий"] > 0).sum())
+    print(f"Только в {file1_path}: {len(report['only_in_1'])}, только в {file2_path}: {len(report['only_in_2'])}, "
+          f"совпало: {len(report['matched'])} (с отличиями: {changed_rows}), "
+          f"неоднозначных: {len(report['ambiguous'])}")
+
+    return write_diff_report(report, output_path)
+
+
 if __name__ == "__main__":
-    file1_path = "main_snab.xlsx"
-    file2_path = "main_alts.xlsx"
-
-    merge_and_color_excel_files(
-        file1_path=file1_path,
-        file2_path=file2_path,
-        column_one="Поставщик",
-        column_two="(номер без @ и без -)",
-        output_path="result.xlsx",
-        col_mark=file2_path
-    )
+    parser = argparse.ArgumentParser(description="Объединение и подсветка совпадений двух выгрузок")
+    parser.add_argument("--single-pass", action="store_true",
+                        help="Однопроходная запись с заливкой (без временного файла)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Потоковый режим для очень больших файлов: размер порции строк")
+    parser.add_argument("--file1", default="main_snab.xlsx", help="Файл 1 (xls/xlsx/csv/parquet/feather)")
+    parser.add_argument("--file2", default="main_alts.xlsx", help="Файл 2 (xls/xlsx/csv/parquet/feather)")
+    parser.add_argument("--output", default="result.xlsx", help="Результат (xlsx; csv - только в потоковом режиме)")
+    parser.add_argument("--diff", metavar="OUTPUT",
+                        help="Вместо подсветки записать отчёт о расхождениях по ключу (xlsx, parquet, feather или csv)")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="Профилировать сравнение (cProfile + tracemalloc): профиль и сводка в папку DIR")
+    parser.add_argument("--profile-top", type=int, default=20, help="Сколько горячих точек выводить в сводке")
+    args = parser.parse_args()
+
+    file1_path = args.file1
+    file2_path = args.file2
+    profiler = StageProfiler(args.profile, top=args.profile_top) if args.profile else None
+
+    stage = "diff" if args.diff else "merge_and_color_streaming" if args.chunksize else "merge_and_color"
+    with profiled(profiler, stage):
+        if args.diff:
+            diff_excel_files(file1_path, file2_path, key_column="(номер без @ и без -)", output_path=args.diff)
+        elif args.chunksize:
+            merge_and_color_streaming(
+                file1_path=file1_path,
+                file2_path=file2_path,
+                column_one="Поставщик",
+                column_two="(номер без @ и без -)",
+                output_path=args.output,
+                col_mark=file2_path,
+                chunksize=args.chunksize,
+            )
+        else:
+            merge_and_color_excel_files(
+                file1_path=file1_path,
+                file2_path=file2_path,
+                column_one="Поставщик",
+                column_two="(номер без @ и без -)",
+                output_path=args.output,
+                col_mark=file2_path,
+                single_pass=args.single_pass,
+            )
 
+    if profiler:
+        profiler.close()
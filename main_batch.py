@@ -0,0 +1,111 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from upd_pipeline import DEFAULT_STORE_FORMAT, build_arg_parser, load_tnved_reference, run_entity
+from run_report import RunReport, StageProfiler
+
+# Юрлица по умолчанию: папка УПД, папка отчёта ABCP, имя итогового файла
+ENTITIES = [
+    {"upd_folder": "upd_alts", "report_folder": "report_abcp_alts", "output": "main_alts"},
+    {"upd_folder": "upd_snab", "report_folder": "report_abcp_snab", "output": "main_snab"},
+]
+
+
+def _run_entity(entity, tnved_index, jobs, incremental, store_format, streaming, fast_export, progress,
+                profile_dir=None, profile_top=20):
+    """
+    Обработка одного юрлица (в т.ч. в дочернем процессе): ошибка возвращается, а не пробрасывается.
+    Отчёт о запуске возвращается словарём (см. RunReport.to_dict).
+    Если задан profile_dir, этапы профилируются в подпапку с именем итогового файла.
+    """
+    profiler = (StageProfiler(os.path.join(profile_dir, entity["output"]), top=profile_top)
+                if profile_dir else None)
+    report = RunReport(entity["output"], profiler=profiler)
+    try:
+        xlsx_path = run_entity(entity["upd_folder"], entity["report_folder"], entity["output"],
+                               tnved_index=tnved_index, jobs=jobs, incremental=incremental,
+                               store_format=store_format, streaming=streaming, fast_export=fast_export,
+                               report=report, progress=progress)
+        return entity["output"], xlsx_path, None, report.to_dict()
+    except Exception as e:
+        return entity["output"], None, str(e), report.to_dict()
+    finally:
+        if profiler:
+            profiler.close()
+
+
+def run_batch(entities, tnved_folder="tnved", entity_jobs=None, jobs=1, incremental=False,
+              store_format=DEFAULT_STORE_FORMAT, streaming=False, fast_export=False, progress=False,
+              profile_dir=None, profile_top=20):
+    """
+    Обрабатывает несколько юрлиц за один запуск.
+
+    Справочник ТН ВЭД загружается один раз и передаётся всем юрлицам,
+    юрлица обрабатываются параллельно в пуле процессов.
+
+    Параметры:
+    entities (list): Список словарей с ключами upd_folder, report_folder, output
+    tnved_folder (str): Папка со справочником ТН ВЭД
+    entity_jobs (int): Сколько юрлиц обрабатывать одновременно (по умолчанию - все)
+    jobs (int): Количество процессов для разбора файлов внутри юрлица
+    incremental (bool): Разбирать только новые и изменённые файлы
+    store_format (str): Формат промежуточных данных
+    streaming (bool): Потоковое чтение xlsx
+    fast_export (bool): Потоковая запись итоговых xlsx
+    progress (bool): Строка прогресса разбора файлов (при параллельной обработке юрлиц строки перемешиваются)
+    profile_dir (str): Папка для профилей этапов (по подпапке на юрлицо)
+    profile_top (int): Сколько горячих точек выводить в сводке профиля
+
+    Возвращает:
+    list: Кортежи (output, xlsx_path, error, report) в порядке entities, report - отчёт о запуске юрлица
+    """
+    tnved_index = load_tnved_reference(tnved_folder)
+    entity_jobs = entity_jobs or len(entities)
+    arguments = [(entity, tnved_index, jobs, incremental, store_format, streaming, fast_export, progress,
+                  profile_dir, profile_top) for entity in entities]
+
+    if entity_jobs <= 1 or len(entities) <= 1:
+        return [_run_entity(*args) for args in arguments]
+
+    with ProcessPoolExecutor(max_workers=entity_jobs) as executor:
+        futures = [executor.submit(_run_entity, *args) for args in arguments]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser("Пакетная обработка УПД нескольких юрлиц с общим справочником ТН ВЭД")
+    parser.add_argument("--entity", nargs=3, action="append", metavar=("UPD_FOLDER", "REPORT_FOLDER", "OUTPUT"),
+                        help="Юрлицо: папка УПД, папка отчёта ABCP, имя итогового файла (можно повторять)")
+    parser.add_argument("--config", help="JSON-файл со списком юрлиц в формате ENTITIES")
+    parser.add_argument("--tnved", default="tnved", help="Папка со справочником ТН ВЭД")
+    parser.add_argument("--entity-jobs", type=int, default=None,
+                        help="Сколько юрлиц обрабатывать одновременно (по умолчанию - все)")
+    args = parser.parse_args()
+
+    if args.config:
+        with open(args.config, encoding='utf-8') as f:
+            entities = json.load(f)
+    elif args.entity:
+        entities = [{"upd_folder": upd, "report_folder": report, "output": output}
+                    for upd, report, output in args.entity]
+    else:
+        entities = ENTITIES
+
+    results = run_batch(entities, tnved_folder=args.tnved, entity_jobs=args.entity_jobs, jobs=args.jobs,
+                        incremental=args.incremental, store_format=args.store_format,
+                        streaming=args.streaming, fast_export=args.fast_export, progress=args.progress,
+                        profile_dir=args.profile, profile_top=args.profile_top)
+
+    for output, xlsx_path, error, _ in results:
+        if error:
+            print(f"❌ Ошибка при обработке {output}: {error}")
+        else:
+            print(f"✅ {output}: {xlsx_path}")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({"entities": [report for _, _, _, report in results]}, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт о запуске сохранён в {args.report}")
+
+    print("Обработка всех юрлиц завершена!")
@@ -0,0 +1,187 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+
+def file_size(path):
+    """Размер файла в байтах (0, если файла нет)."""
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+class RunReport:
+    """
+    Метрики одного запуска: этапы, обработанные файлы и ошибки.
+
+    Этап оформляется через with report.stage(name) as stage: в словарь stage
+    записываются метрики (rows, tables, bytes_read, bytes_written, match_rate...),
+    время этапа проставляется автоматически. Отчёт сохраняется в JSON (save).
+    Если передан profiler (StageProfiler), каждый этап ещё и профилируется.
+    """
+
+    def __init__(self, name, profiler=None):
+        self.name = name
+        self.profiler = profiler
+        self.started_at = datetime.now().isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        self.stages = []
+        self.files = []
+        self.errors = []
+
+    @contextmanager
+    def stage(self, name, **metrics):
+        record = {"stage": name, **metrics}
+        start = time.perf_counter()
+        try:
+            with profiled(self.profiler, name):
+                yield record
+        except Exception as e:
+            record["error"] = str(e)
+            self.error(name, e)
+            raise
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 4)
+            self.stages.append(record)
+
+    def file(self, path, **metrics):
+        """Метрики обработки одного исходного файла."""
+        self.files.append({"file": path, **metrics})
+
+    def error(self, where, error, file=None):
+        entry = {"where": where, "error": str(error)}
+        if file:
+            entry["file"] = file
+        self.errors.append(entry)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "seconds": round(time.perf_counter() - self._start, 4),
+            "totals": {
+                "files": len(self.files),
+                "tables": sum(entry.get("tables", 0) for entry in self.files),
+                "rows": sum(entry.get("rows", 0) for entry in self.files),
+                "errors": len(self.errors),
+            },
+            "stages": self.stages,
+            "files": self.files,
+            "errors": self.errors,
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        return path
+
+
+class ProgressLine:
+    """
+    Строка прогресса с оценкой оставшегося времени, перерисовываемая на месте (в stderr).
+    При enabled=False ничего не выводит.
+    """
+
+    def __init__(self, total, label="", enabled=True, stream=None):
+        self.total = total
+        self.label = label
+        self.enabled = enabled and total > 0
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self._start = time.perf_counter()
+
+    def update(self, step=1, info=""):
+        self.done += step
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - self._start
+        eta = elapsed / self.done * (self.total - self.done) if self.done else 0
+        line = (f"{self.label} {self.done}/{self.total} ({self.done / self.total:.0%}), "
+                f"прошло {elapsed:.0f} с, осталось ~{eta:.0f} с {info}")
+        self.stream.write("\r" + line[:120].ljust(120))
+        self.stream.flush()
+
+    def close(self):
+        if self.enabled:
+            self.stream.write("\n")
+            self.stream.flush()
+
+
+class StageProfiler:
+    """
+    Профилирование этапов: cProfile и снимки tracemalloc до и после этапа.
+
+    Для каждого этапа в output_dir пишется NN_<этап>.prof (открывается pstats,
+    snakeviz и т.п.), close() сохраняет summary.txt с top функциями по
+    накопленному времени и top строками по приросту памяти для каждого этапа.
+    Дочерние процессы пула не профилируются - для полной картины запускайте с -j 1.
+    """
+
+    def __init__(self, output_dir, top=20, memory=True):
+        self.output_dir = output_dir
+        self.top = top
+        self.memory = memory
+        self.sections = []
+        self.profile_paths = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        started_tracing = self.memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+
+            safe_name = re.sub(r'[^\w.-]+', '_', name)
+            file_name = f"{len(self.sections) + 1:02d}_{safe_name}.prof"
+            self.profile_paths.append(os.path.join(self.output_dir, file_name))
+            profile.dump_stats(self.profile_paths[-1])
+
+            buffer = io.StringIO()
+            pstats.Stats(profile, stream=buffer).sort_stats('cumulative').print_stats(self.top)
+            section = [f"=== {name}: {elapsed:.3f} с, профиль {file_name}", buffer.getvalue().strip()]
+
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                growth = tracemalloc.take_snapshot().compare_to(before, 'lineno')[:self.top]
+                if started_tracing:
+                    tracemalloc.stop()
+                section.append(f"Пик памяти: {peak / 2 ** 20:.1f} МБ; прирост по строкам:")
+                section.extend(str(stat) for stat in growth)
+
+            self.sections.append("\n".join(section))
+
+    def close(self):
+        """Сохраняет summary.txt (общие горячие точки по собственному времени и разбивка по этапам)."""
+        summary_path = os.path.join(self.output_dir, "summary.txt")
+        sections = list(self.sections)
+        if self.profile_paths:
+            buffer = io.StringIO()
+            pstats.Stats(*self.profile_paths, stream=buffer).sort_stats('tottime').print_stats(self.top)
+            sections.insert(0, f"=== Горячие точки всех этапов\n{buffer.getvalue().strip()}")
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(sections) + "\n")
+        print(f"Профили этапов и сводка сохранены в {self.output_dir}")
+        return summary_path
+
+
+def profiled(profiler, name):
+    """Этап под профилировщиком; без профилировщика - пустой контекст без накладных расходов."""
+    return profiler.stage(name) if profiler else nullcontext()
@@ -0,0 +1,232 @@
+import os
+import random
+import zipfile
+import argparse
+import importlib.util
+from openpyxl import Workbook
+
+from upd_pipeline import ABCP_COLUMNS, ABCP_KEY_COLUMN, TARGET_HEADERS
+
+# Старый формат xls пишется через xlwt, если он установлен, иначе генерируются только xlsx
+HAS_XLWT = importlib.util.find_spec('xlwt') is not None
+
+# Заголовок таблицы товаров в УПД - без столбцов метаданных, которые добавляет разбор
+UPD_TABLE_HEADER = TARGET_HEADERS[:-3]
+COUNTRIES = ["КИТАЙ", "ГЕРМАНИЯ", "ЯПОНИЯ", "--", "-", "----"]
+UNITS = [("796", "шт"), ("166", "кг"), ("006", "м")]
+# Строка названий над строкой номеров столбцов, как в бланке УПД (заполнена по всей ширине таблицы)
+UPD_TABLE_TITLES = [
+    "Код товара/ работ, услуг", "Наименование товара", "Код вида товара", "Код товара по ТН ВЭД",
+    "Единица измерения: код", "условное обозначение", "Количество (объем)", "Цена (тариф) за единицу",
+    "Стоимость без налога", "В том числе сумма акциза", "Налоговая ставка", "Сумма налога",
+    "Стоимость с налогом", "Страна происхождения: код", "краткое наименование", "Регистрационный номер ДТ",
+    "Единица прослеживаемости: код", "условное обозначение", "Количество прослеживаемости",
+    "Стоимость прослеживаемости",
+]
+
+
+def article_pool(n_articles, seed=0):
+    """
+    Артикулы в том виде, в каком они встречаются в УПД: с разделителями '-' и '@',
+    иногда с пробелами по краям. Ключ без разделителей совпадает у справочников и УПД.
+    """
+    rnd = random.Random(seed)
+    articles = []
+    for idx in range(n_articles):
+        brand = rnd.choice(["AB", "KYB", "SKF", "NGK", "MANN", "BOSCH"])
+        article = f"{brand}-{rnd.randint(100, 999)}{idx:05d}"
+        if idx % 5 == 0:
+            article += f"@{rnd.randint(1, 9)}"
+        if idx % 11 == 0:
+            article = f" {article} "
+        articles.append(article)
+    return articles
+
+
+def article_key(article):
+    """Ключ артикула, как его строит пайплайн: без '@' и '-' и пробелов по краям."""
+    return article.replace('@', '').replace('-', '').strip()
+
+
+def upd_rows(seed, variant, articles, tables=2, rows_per_table=50):
+    """
+    Строки листа УПД: шапка счёта-фактуры, метки продавца/ИНН/отгрузки и tables таблиц товаров.
+
+    variant 0 - метки с двоеточием и номерами столбцов ((2), (2б), (5а)),
+    variant 1 - метки без номеров, документ отгрузки "тот же" (берётся из счёта-фактуры).
+    """
+    rnd = random.Random(seed)
+    rows = [["Счет-фактура №", f"{seed}", "от", f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2024"], []]
+    if variant == 0:
+        rows.append(["Продавец:", f"ООО Ромашка {seed}", "(2)"])
+        rows.append(["ИНН/КПП продавца:", f"77{seed:08d}/770101001", "(2б)"])
+        rows.append(["Документ об отгрузке", f"№ п/п 1-{rows_per_table} от 01.01.2024", "(5а)"])
+    else:
+        rows.append(["Продавец", f"ООО Лютик {seed}"])
+        rows.append(["ИНН/КПП продавца", f"78{seed:08d}/780101001"])
+        rows.append(["Документ об отгрузке:", "тот же документ"])
+    rows.append([])
+
+    for _ in range(tables):
+        rows.append(list(UPD_TABLE_TITLES))
+        rows.append(list(UPD_TABLE_HEADER))
+        for idx in range(rows_per_table):
+            unit_code, unit = rnd.choice(UNITS)
+            qty = rnd.randint(1, 20)
+            price = rnd.randint(100, 99999) / 100
+            country = rnd.choice(COUNTRIES)
+            amount = qty * price
+            # Столбцы как в UPD_TABLE_HEADER: А, 1, 1а, 1б (ТН ВЭД пустой - подставит справочник), 2, 2а, 3, ...
+            rows.append([
+                rnd.choice(articles), f"Товар {rnd.randint(1, 99999)}", "--", "", unit_code, unit, f"{qty}",
+                f"{price:,.2f}".replace(",", " "), f"{amount:,.2f} ".replace(",", " "), "без акциза", "20%",
+                f"{amount * 0.2:.2f}", f"{amount * 1.2:,.2f}".replace(",", " "),
+                "-" if country.startswith("-") else "156", country, "--", "", "", "", "",
+            ])
+        rows.append([])
+        rows.append(["Всего к оплате", "", "", "", "", "", "", "", "", "", "", ""])
+        rows.append([])
+    return rows
+
+
+def write_xlsx_rows(path, rows, sheet_title="Sheet1"):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+    for row in rows:
+        ws.append(row if row else [None])
+    wb.save(path)
+
+
+def write_xls_rows(path, rows, sheet_title="Sheet1"):
+    import xlwt
+    wb = xlwt.Workbook()
+    ws = wb.add_sheet(sheet_title)
+    for row_idx, row in enumerate(rows):
+        for col_idx, value in enumerate(row):
+            ws.write(row_idx, col_idx, value)
+    wb.save(path)
+
+
+def generate_upd_folder(folder, articles, n_files, tables=2, rows_per_table=50, xls_every=3, seed=0):
+    """
+    Пишет n_files УПД: оба варианта меток по очереди, каждый xls_every-й файл - xls (если есть xlwt).
+
+    Возвращает:
+    list: Пути к созданным файлам
+    """
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for idx in range(n_files):
+        rows = upd_rows(seed + idx + 1, idx % 2, articles, tables, rows_per_table)
+        if HAS_XLWT and xls_every and idx % xls_every == xls_every - 1:
+            path = os.path.join(folder, f"upd_{idx:05d}.xls")
+            write_xls_rows(path, rows)
+        else:
+            path = os.path.join(folder, f"upd_{idx:05d}.xlsx")
+            write_xlsx_rows(path, rows)
+        paths.append(path)
+    return paths
+
+
+def generate_tnved_reference(path, articles, coverage=0.75, seed=0):
+    """
+    Справочник ТН ВЭД: артикул в 1-м столбце, код в 6-м (как в load_tnved_index).
+    Покрывает долю coverage артикулов, часть ключей - в другом регистре.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows = [["Артикул", "Наименование", "Бренд", "Группа", "Примечание", "ТНВЭД"]]
+    for idx, article in enumerate(articles):
+        if rnd.random() >= coverage:
+            continue
+        key = article_key(article)
+        rows.append([key.lower() if idx % 2 else key, f"Товар {idx}", "BR", "G", "",
+                     f"{rnd.randint(8400000000, 8799999999)}"])
+    write_xlsx_rows(path, rows)
+    return path
+
+
+def generate_abcp_report(path, articles, coverage=0.66, seed=0):
+    """
+    Отчёт ABCP: ключ ABCP_KEY_COLUMN и столбцы ABCP_COLUMNS плюс лишний столбец.
+    Пишется в xls через xlwt, а без него - xlsx с расширением .xls (формат определяется по содержимому).
+    """
+    rnd = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    rows = [[ABCP_KEY_COLUMN] + ABCP_COLUMNS + ["Комментарий"]]
+    for idx, article in enumerate(articles):
+        if rnd.random() >= coverage:
+            continue
+        key = article_key(article)
+        rows.append([key, f"Клиент {rnd.randint(1, 500)}", f"Поставщик {idx % 7}", "BR", key, "Описание",
+                     rnd.choice(["Наличные", "Безналичные"]), rnd.randint(1, 50), rnd.randint(100, 99999) / 100,
+                     rnd.randint(1, 5000) / 1000, "Минск", "admin", ""])
+    if HAS_XLWT and len(rows) <= 65536:
+        write_xls_rows(path, rows)
+    else:
+        write_xlsx_rows(path, rows)
+    return path
+
+
+def generate_zip_dump(path, n_lines, members=1, seed=0):
+    """
+    Архив с выгрузкой: members txt-файлов по n_lines строк с табуляцией,
+    строкой заголовка, пустыми строками и кодами с ведущими нулями.
+    """
+    rnd = random.Random(seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+        for member in range(members):
+            with zip_ref.open(f"dump_{member + 1}.txt", "w") as raw_file:
+                raw_file.write("Код\tНаименование\tКоличество\tЦена\tТНВЭД\tСтрана\r\n".encode("utf-8"))
+                for idx in range(n_lines):
+                    line = (f"A{idx:07d}\tТовар {rnd.randint(1, 99999)}\t{rnd.randint(1, 500)}\t"
+                            f"{rnd.randint(1, 99999)}.{rnd.randint(0, 99):02d}\t0{rnd.randint(10 ** 8, 10 ** 9 - 1)}\t"
+                            f"{rnd.choice(COUNTRIES)}\r\n")
+                    if idx % 1000 == 999:
+                        line += "\r\n"
+                    raw_file.write(line.encode("utf-8"))
+    return path
+
+
+def generate_dataset(root, n_files=20, tables=2, rows_per_table=50, zip_lines=10000, zip_members=2, seed=0):
+    """
+    Полный набор данных для прогона пайплайна в папке root:
+    upd_alts/ (УПД), tnved/ (справочник), report_abcp_alts/ (отчёт ABCP), dumps/ (zip с txt).
+
+    Возвращает:
+    dict: Пути к созданным папкам и файлам
+    """
+    n_articles = max(10, n_files * tables * rows_per_table // 4)
+    articles = article_pool(n_articles, seed)
+    dataset = {
+        "upd_folder": os.path.join(root, "upd_alts"),
+        "tnved_folder": os.path.join(root, "tnved"),
+        "report_folder": os.path.join(root, "report_abcp_alts"),
+        "zip_folder": os.path.join(root, "dumps"),
+    }
+    dataset["upd_files"] = generate_upd_folder(dataset["upd_folder"], articles, n_files, tables, rows_per_table,
+                                               seed=seed)
+    dataset["tnved_path"] = generate_tnved_reference(os.path.join(dataset["tnved_folder"], "tnved.xlsx"),
+                                                     articles, seed=seed)
+    dataset["report_path"] = generate_abcp_report(os.path.join(dataset["report_folder"], "report.xls"),
+                                                  articles, seed=seed)
+    dataset["zip_path"] = generate_zip_dump(os.path.join(dataset["zip_folder"], "dump.zip"), zip_lines,
+                                            zip_members, seed=seed)
+    return dataset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Генерация синтетических УПД, справочников и zip-выгрузок")
+    parser.add_argument("root", help="Папка для набора данных")
+    parser.add_argument("--files", type=int, default=20, help="Количество файлов УПД")
+    parser.add_argument("--tables", type=int, default=2, help="Таблиц товаров в файле")
+    parser.add_argument("--rows", type=int, default=50, help="Строк в таблице")
+    parser.add_argument("--zip-lines", type=int, default=10000, help="Строк в каждом txt выгрузки")
+    parser.add_argument("--zip-members", type=int, default=2, help="txt-файлов в архиве")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.root, args.files, args.tables, args.rows, args.zip_lines, args.zip_members,
+                               args.seed)
+    print(f"Создано {len(dataset['upd_files'])} УПД, справочники и выгрузка в {args.root}")
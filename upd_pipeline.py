@@ -0,0 +1,1424 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import ERROR_CODES
+from glob import glob
+import re
+
+from run_report import ProgressLine, RunReport, file_size
+from xlsx_writer import EXCEL_MAX_ROWS, RolloverSheets
+
+
+def is_valid_string(s):
+    # Проверяем, что строка состоит только из цифр (0-9), точек (.) и пробелов (\s)
+    return bool(re.fullmatch(r'^[\d.\s]+$', s))
+
+
+DATA_TO_PARSE = [
+    ['Продавец:', '(2)'],
+    ['ИНН/КПП продавца:', '(2б)'],
+    ['Документ об отгрузке', '(5а)'],
+]
+
+DATA_TO_PARSE_NO_INDEX = [
+    ['Продавец', '(2)'],
+    ['ИНН/КПП продавца', '(2б)'],
+    ['Документ об отгрузке:', '(5а)'],
+]
+
+# Если в альтернативном варианте вместо значения стоит "тот же...", значение берётся из строки счёта-фактуры
+INVOICE_LABEL = 'Счет-фактура'
+
+METADATA_LABELS = [item[0] for item in DATA_TO_PARSE + DATA_TO_PARSE_NO_INDEX] + [INVOICE_LABEL]
+
+TARGET_HEADERS = [
+    "А", "1", "1а", "1б", "2", "2а", "3", "4", "5", "6", "7", "8", "9", "10", "10а", "11", "12", "12а", "13", "14",
+    "(5а)", "(2)", "(2б)"
+]
+clean_number = "(номер без @ и без -)"
+COLUMN_ORDER = [
+    "А", clean_number, "1", "1а", "1б", "2", "2а", "3",
+    "4", "5", "6", "7", "8", "9", "10", "10а", "11", "12",
+    "12а", "13", "14", "(5а)", "(2)", "(2б)"
+]
+
+# Типы столбцов COLUMN_ORDER. Задаются один раз при извлечении (apply_schema) и сохраняются
+# на всех этапах: 'object' - строки (ключи, наименования, коды с ведущими нулями),
+# 'float64' - количества, цены и суммы, 'category' - повторяющиеся значения
+# (единицы измерения, ставка, страна, реквизиты файла)
+COLUMN_SCHEMA = {
+    "А": "object", clean_number: "object", "1": "object", "1а": "object", "1б": "object",
+    "2": "category", "2а": "category", "3": "float64", "4": "float64", "5": "float64",
+    "6": "object", "7": "category", "8": "float64", "9": "float64", "10": "category", "10а": "category",
+    "11": "object", "12": "category", "12а": "category", "13": "float64", "14": "float64",
+    "(5а)": "category", "(2)": "category", "(2б)": "category",
+}
+
+# Промежуточные данные хранятся в колоночном формате, если доступен pyarrow
+COLUMNAR_FORMATS = ('parquet', 'feather')
+DEFAULT_STORE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'csv'
+# Кеши справочников (индексы ТН ВЭД, отчёт ABCP)
+CACHE_DIR = ".cache"
+
+ABCP_KEY_COLUMN = "Номер без разделителей"
+ABCP_COLUMNS = [
+    "Клиент",
+    "Поставщик",
+    "Бренд",
+    "Номер",
+    "Описание",
+    "Тип оплаты",
+    "Кол.",
+    "Цена продажи",
+    "Вес",
+    "Адрес доставки",
+    "Создал",
+]
+# Столбцы отчёта ABCP, которые всегда остаются строками (артикулы с ведущими нулями)
+ABCP_SCHEMA = {"Номер": "object"}
+# Схема итоговой таблицы: столбцы УПД и добавленные из отчёта ABCP
+EXPORT_SCHEMA = {**COLUMN_SCHEMA, **ABCP_SCHEMA}
+
+
+def table_format(path):
+    """Формат хранения по расширению файла: csv, parquet или feather."""
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return ext if ext in COLUMNAR_FORMATS else 'csv'
+
+
+def schema_string(value):
+    """Значение строкового столбца схемы: целые числа без '.0' (коды, артикулы), NaN остаётся NaN."""
+    if pd.isna(value):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def to_float_column(values, column=None):
+    """
+    Числовой столбец схемы: пробелы (в т.ч. разделители тысяч) убираются, пустые строки - NaN.
+    Если хотя бы одно значение не число, столбец остаётся строковым, как и раньше.
+    """
+    if (pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values)) or values.isna().all():
+        return values.astype('float64')
+
+    strings = values.astype('object').map(schema_string)
+    cleaned = strings.str.replace(r'\s+', '', regex=True)
+    cleaned = cleaned.where(cleaned != '', np.nan)
+    numbers = pd.to_numeric(cleaned, errors='coerce')
+    if (numbers.isna() & cleaned.notna()).any():
+        print(f"Предупреждение: столбец '{column}' содержит нечисловые значения и остаётся строковым")
+        return strings.astype('object')
+    return numbers.astype('float64')
+
+
+def is_string_column(values):
+    """Все значения столбца - строки (или пропуски)."""
+    if isinstance(values.dtype, pd.StringDtype):
+        return True
+    return values.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty')
+
+
+def has_schema_type(values, dtype, parse=False):
+    """
+    Столбец уже имеет тип схемы. Без parse числовой столбец из одних строк
+    считается оставленным строковым при извлечении и повторно не разбирается.
+    """
+    if dtype == 'object':
+        return is_string_column(values)
+    if dtype == 'float64' and not parse and is_string_column(values) and values.notna().any():
+        return True
+    return values.dtype == dtype
+
+
+def apply_schema(df, schema=COLUMN_SCHEMA, parse=False):
+    """
+    Приводит столбцы df, перечисленные в schema, к их типам (см. COLUMN_SCHEMA).
+    Столбцы, уже имеющие нужный тип, не пересчитываются, поэтому повторный вызов дешёвый.
+
+    Параметры:
+    df (pd.DataFrame): Таблица (изменяется на месте)
+    schema (dict): Столбец -> 'object', 'float64' или 'category'
+    parse (bool): Разбирать строковые значения числовых столбцов (при извлечении из УПД)
+
+    Возвращает:
+    pd.DataFrame: Тот же DataFrame с приведёнными столбцами
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns or has_schema_type(df[col], dtype, parse):
+            continue
+        if dtype == 'float64':
+            df[col] = to_float_column(df[col], col)
+        else:
+            strings = df[col].astype('object').map(schema_string).astype('object')
+            df[col] = strings.astype('category') if dtype == 'category' else strings
+    return df
+
+
+def to_columnar(df, schema=None):
+    """
+    Подготавливает DataFrame к записи в Parquet/Feather: столбцы object со
+    смешанными значениями становятся числовыми, если все значения числовые,
+    иначе строковыми (так же, как их увидел бы CSV).
+    Строковые столбцы из schema всегда остаются строками (см. schema_string).
+    """
+    df = df.reset_index(drop=True)
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        if schema is not None and col in schema:
+            df[col] = df[col].map(schema_string).astype('object')
+            continue
+        try:
+            df[col] = pd.to_numeric(df[col])
+        except (ValueError, TypeError):
+            df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value)).astype('object')
+    return df
+
+
+def read_table(path, dtype=None, schema=None):
+    """
+    Читает таблицу из CSV, Parquet или Feather.
+
+    Параметры:
+    path (str): Путь к файлу
+    dtype (str/dict): Как в pd.read_csv; 'object' для столбца означает строковые значения
+    schema (dict): Типы столбцов (например, COLUMN_SCHEMA); столбцы схемы не угадываются,
+        а приводятся к своим типам. Parquet/Feather хранят типы, и приведение для них не нужно
+
+    Возвращает:
+    pd.DataFrame: Прочитанная таблица
+    """
+    fmt = table_format(path)
+    if fmt == 'csv':
+        if schema and not isinstance(dtype, str):
+            header = pd.read_csv(path, nrows=0).columns
+            dtype = {(header[key] if isinstance(key, int) else key): value for key, value in (dtype or {}).items()}
+            # Числа разбирает сам read_csv, строки и категории читаются без угадывания типов
+            dtype.update({col: 'object' for col in header if schema.get(col) in ('object', 'category')})
+        df = pd.read_csv(path, dtype=dtype)
+        return apply_schema(df, schema) if schema else df
+
+    df = pd.read_parquet(path) if fmt == 'parquet' else pd.read_feather(path)
+    if dtype is not None:
+        positions = range(len(df.columns)) if isinstance(dtype, str) else dtype.keys()
+        for key in positions:
+            col = df.columns[key] if isinstance(key, int) else key
+            if col in df.columns and not (schema and col in schema):
+                df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value)).astype('object')
+    return apply_schema(df, schema) if schema else df
+
+
+def write_table(df, path, encoding='utf-8', schema=None):
+    """Записывает таблицу в CSV, Parquet или Feather в зависимости от расширения (schema - см. to_columnar)."""
+    fmt = table_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False, encoding=encoding)
+    elif fmt == 'parquet':
+        to_columnar(df, schema).to_parquet(path, index=False)
+    else:
+        to_columnar(df, schema).to_feather(path)
+    return path
+
+
+def file_signature(file_path, content_hash=False):
+    """Подпись файла для манифеста и кешей: размер, время изменения и (опционально) SHA-1 содержимого."""
+    stat = os.stat(file_path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if content_hash:
+        sha1 = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(chunk)
+        signature["sha1"] = sha1.hexdigest()
+    return signature
+
+
+def cached_build(cache_name, source_path, options, build, content_hash=False, cache_dir=CACHE_DIR):
+    """
+    Возвращает результат build() из кеша, пока исходный файл и параметры не изменились.
+
+    Параметры:
+    cache_name (str): Префикс имени файла кеша
+    source_path (str): Исходный файл, по подписи которого проверяется кеш
+    options (dict): Параметры построения (входят в ключ кеша)
+    build (callable): Функция построения данных при промахе кеша
+    content_hash (bool): Проверять SHA-1 содержимого, а не только размер и mtime
+    cache_dir (str): Каталог кеша
+
+    Возвращает:
+    object: Данные из кеша или результат build()
+    """
+    signature = file_signature(source_path, content_hash)
+    digest = hashlib.md5(os.path.abspath(source_path).encode('utf-8')).hexdigest()[:12]
+    cache_path = os.path.join(cache_dir, f"{cache_name}_{digest}.pkl")
+
+    if os.path.exists(cache_path):
+        try:
+            cached = pd.read_pickle(cache_path)
+            if cached["signature"] == signature and cached["options"] == options:
+                print(f"Используется кеш {cache_path} для {source_path}")
+                return cached["data"]
+        except Exception as e:
+            print(f"⚠️ Кеш {cache_path} повреждён и будет пересобран: {e}")
+
+    data = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    pd.to_pickle({"signature": signature, "options": options, "data": data}, cache_path)
+    return data
+
+
+def normalize_key(key, case_sensitive=False, strip_spaces=True):
+    """Нормализация ключа для сопоставления со справочником."""
+    key = str(key) if pd.notna(key) else ""
+    if strip_spaces:
+        key = key.strip()
+    if not case_sensitive:
+        key = key.lower()
+    return key
+
+
+def normalize_keys(keys, case_sensitive=False, strip_spaces=True):
+    """Векторная версия normalize_key для целого столбца."""
+    keys = keys.astype('object').where(keys.notna(), "").astype(str)
+    if strip_spaces:
+        keys = keys.str.strip()
+    if not case_sensitive:
+        keys = keys.str.lower()
+    return keys
+
+
+def build_key_index(df, key_col, value_col, case_sensitive=False, strip_spaces=True):
+    """
+    Строит индекс нормализованный ключ -> значение (при повторах побеждает последний).
+    Значения - строки (schema_string): коды ТН ВЭД сохраняют ведущие нули.
+
+    Возвращает:
+    pd.Series: Значения с нормализованными ключами в индексе
+    """
+    keys = df.iloc[:, key_col]
+    values = df.iloc[:, value_col].astype('object').map(schema_string)
+    mask = keys.notna().to_numpy()
+
+    normalized = normalize_keys(keys[mask], case_sensitive, strip_spaces)
+    index = pd.Series(values[mask].to_numpy(), index=normalized.to_numpy(dtype=object))
+    return index[~index.index.duplicated(keep='last')]
+
+
+def load_tnved_index(xlsx_path, key_col=0, value_col=5, case_sensitive=False, strip_spaces=True):
+    """
+    Загружает справочник ТН ВЭД как готовый индекс ключ -> код.
+
+    Индекс строится из xlsx один раз и хранится в кеше (CACHE_DIR), пока
+    не изменится файл справочника или параметры нормализации ключей.
+    """
+    # values_as_text - индекс со строковыми кодами; кеши прежних версий (числовые коды) пересобираются
+    options = {"key_col": key_col, "value_col": value_col,
+               "case_sensitive": case_sensitive, "strip_spaces": strip_spaces, "values_as_text": True}
+
+    def build():
+        df = pd.read_excel(xlsx_path, dtype='object')
+        return build_key_index(df, key_col, value_col, case_sensitive, strip_spaces)
+
+    return cached_build("tnved", xlsx_path, options, build)
+
+
+def sniff_excel_engine(file_path):
+    """Определяет движок чтения по сигнатуре файла, а не по расширению."""
+    with open(file_path, 'rb') as f:
+        head = f.read(8)
+    if head.startswith(b'PK'):
+        return 'openpyxl'
+    if head.startswith(b'\xd0\xcf\x11\xe0'):
+        return 'xlrd'
+    raise ValueError(f"Не удалось определить формат файла: {file_path}")
+
+
+def load_abcp_report(report_path, key_column=ABCP_KEY_COLUMN, columns_to_add=ABCP_COLUMNS, sheet_name=0):
+    """
+    Читает отчёт ABCP напрямую (без временного CSV): формат определяется один раз,
+    читаются только ключ и columns_to_add.
+
+    Результат кешируется (CACHE_DIR) по SHA-1 содержимого отчёта.
+
+    Возвращает:
+    pd.DataFrame: Столбцы [key_column] + columns_to_add, ключ и столбцы ABCP_SCHEMA - строки
+    """
+    options = {"key_column": key_column, "columns_to_add": list(columns_to_add), "sheet_name": sheet_name,
+               "text_columns": sorted(ABCP_SCHEMA)}
+
+    def build():
+        wanted = [key_column] + list(columns_to_add)
+        df = pd.read_excel(report_path, sheet_name=sheet_name, engine=sniff_excel_engine(report_path),
+                           usecols=lambda col: col in wanted, dtype='object')
+
+        missing_columns = [col for col in wanted if col not in df.columns]
+        if missing_columns:
+            raise ValueError(f"Столбцы {missing_columns} не найдены в {report_path}")
+
+        report_df = to_columnar(df[list(columns_to_add)], schema=ABCP_SCHEMA)
+        report_df.insert(0, key_column,
+                         df[key_column].map(lambda value: value if pd.isna(value) else str(value)).astype('object'))
+        return report_df
+
+    return cached_build("abcp", report_path, options, build, content_hash=True)
+
+
+def merge_csv_preserve_headers(
+        csv1_path: str,
+        csv2_path: str,
+        output_path: str = None,
+        csv1_key_col: int = 1,  # Ключ во 2-м столбце (индекс 1)
+        csv1_target_col: int = 4,  # Целевой столбец в 1-м файле (5-й столбец, индекс 4)
+        csv2_key_col: int = 0,  # Ключ в 1-м столбце (индекс 0)
+        csv2_value_col: int = 5,  # Значение в 6-м столбце (индекс 5)
+        keep_unmatched: bool = True,
+        case_sensitive: bool = False,
+        strip_spaces: bool = True,
+        value_index: pd.Series = None
+) -> pd.DataFrame:
+    """
+    Заменяет данные в 5-м столбце первого CSV на значения из 6-го столбца второго CSV,
+    сохраняя заголовки (первую строку) неизменными.
+    Гарантирует, что первый и второй столбцы обрабатываются как строки (object),
+    столбцы COLUMN_SCHEMA сохраняют свои типы.
+    Если передан value_index (например, из load_tnved_index), второй CSV не читается.
+    """
+    # Загрузка данных с сохранением заголовков
+    df1 = read_table(csv1_path, dtype={0: 'object', 1: 'object'}, schema=COLUMN_SCHEMA)
+
+    if value_index is None:
+        df2 = read_table(csv2_path, dtype={0: 'object', 1: 'object'})
+        value_index = build_key_index(df2, csv2_key_col, csv2_value_col, case_sensitive, strip_spaces)
+
+    # Ключи нормализуются векторно, сопоставление - через хеш-индекс справочника
+    keys = normalize_keys(df1.iloc[:, csv1_key_col], case_sensitive, strip_spaces).to_numpy(dtype=object)
+    matched = value_index.index.get_indexer(keys) >= 0
+
+    result = df1.copy()
+    target = result.columns[csv1_target_col]
+    result[target] = value_index.reindex(keys).to_numpy()
+    if target in COLUMN_SCHEMA:
+        # Коды справочника приводятся к типу столбца (для "1б" - строки без '.0')
+        apply_schema(result, {target: COLUMN_SCHEMA[target]})
+
+    match_rate = matched.mean() if len(matched) else 0.0
+    result.attrs["match_rate"] = match_rate
+    print(f"Совпадений по справочнику: {int(matched.sum())} из {len(matched)} ({match_rate:.1%})")
+
+    if not keep_unmatched:
+        result = result.dropna(subset=[result.columns[csv1_target_col]])
+
+    if output_path:
+        write_table(result, output_path, schema=COLUMN_SCHEMA)
+
+    return result
+
+
+def merge_csv_files(
+        file_1_path: str,
+        file_2_path: str,
+        output_path: str = None,
+        key_column_1: str = "(номер без @ и без -)",
+        key_column_2: str = ABCP_KEY_COLUMN,
+        columns_to_add: list = ABCP_COLUMNS,
+        report_df: pd.DataFrame = None,
+) -> pd.DataFrame:
+    """
+    Добавляет в file_1.csv новые столбцы из file_2.csv по совпадению ключей.
+    Гарантирует, что первый и второй столбцы обрабатываются как строки (object),
+    столбцы COLUMN_SCHEMA сохраняют свои типы.
+    Если передан report_df (например, из load_abcp_report), file_2 не читается.
+    Доля строк, нашедших пару в отчёте, - в attrs["match_rate"] результата.
+    """
+    # Загружаем оба файла с явным указанием типов для первых двух столбцов
+    df1 = read_table(file_1_path, dtype={0: 'object', 1: 'object'}, schema=COLUMN_SCHEMA)
+
+    if report_df is None:
+        df2 = read_table(file_2_path, dtype={0: 'object', 1: 'object'})
+    else:
+        df2 = report_df
+
+    if key_column_1 not in df1.columns:
+        raise ValueError(f"Столбец '{key_column_1}' не найден в {file_1_path}")
+    if key_column_2 not in df2.columns:
+        raise ValueError(f"Столбец '{key_column_2}' не найден в {file_2_path}")
+
+    missing_columns = [col for col in columns_to_add if col not in df2.columns]
+    if missing_columns:
+        raise ValueError(f"Столбцы {missing_columns} не найдены в {file_2_path}")
+
+    df2_selected = df2[[key_column_2] + columns_to_add]
+
+    merged_df = df1.merge(
+        df2_selected,
+        how="left",
+        left_on=key_column_1,
+        right_on=key_column_2,
+    )
+
+    matched = df1[key_column_1].isin(df2_selected[key_column_2]).to_numpy()
+    match_rate = matched.mean() if len(matched) else 0.0
+    print(f"Совпадений с отчётом ABCP: {int(matched.sum())} из {len(matched)} ({match_rate:.1%})")
+
+    if key_column_1 != key_column_2:
+        merged_df.drop(columns=[key_column_2], inplace=True)
+
+    merged_df.attrs["match_rate"] = match_rate
+
+    output_path = output_path or file_1_path
+    write_table(merged_df, output_path, encoding="utf-8", schema=EXPORT_SCHEMA)
+    print(f"Файл успешно сохранён: {output_path}")
+
+    return merged_df
+
+
+def merge_csv_by_headers(source_path, target_path):
+    try:
+        # Чтение данных
+        source_df = read_table(source_path, schema=COLUMN_SCHEMA)
+        target_df = read_table(target_path, schema=COLUMN_SCHEMA)
+
+        # Проверка на пустые данные
+        if source_df.empty:
+            print(f"⚠️ Источник {source_path} пуст - пропускаем")
+            return
+
+        if target_df.empty:
+            print(f"⚠️ Цель {target_path} пуста - создаем новый")
+            # Приводим столбцы к нужному порядку перед сохранением
+            ordered_df = source_df.reindex(columns=COLUMN_ORDER)
+            ordered_df.to_csv(target_path, index=False, encoding='utf-8-sig')
+            return
+
+        # Приводим оба DataFrame к нужному порядку столбцов
+        source_df = source_df.reindex(columns=COLUMN_ORDER)
+        target_df = target_df.reindex(columns=COLUMN_ORDER)
+
+        # Объединение (категории разных частей объединяются заново)
+        merged_df = apply_schema(pd.concat([target_df, source_df], ignore_index=True))
+
+        # Убедимся, что порядок сохранился
+        merged_df = merged_df[COLUMN_ORDER]
+
+        # Сохранение
+        merged_df.to_csv(target_path, index=False, encoding='utf-8-sig')
+        print(f"✅ Успешно объединено {len(source_df)} записей в {target_path}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при объединении {source_path} -> {target_path}: {str(e)}")
+
+
+def clean_and_convert_to_float(df, columns):
+    """
+    Очищает указанные колонки от лишних пробелов и преобразует их в тип float.
+
+    Параметры:
+    df (pd.DataFrame): Исходный DataFrame
+    columns (list): Список колонок для обработки
+
+    Возвращает:
+    pd.DataFrame: Новый DataFrame с обработанными колонками
+    """
+    # Создаём копию DataFrame, чтобы не изменять исходный
+    new_df = df.copy()
+
+    for col in columns:
+        if col in new_df.columns:
+            try:
+                # Удаляем лишние пробелы и преобразуем в float
+                new_df[col] = (
+                    new_df[col]
+                    .astype(str)  # Преобразуем в строку на случай, если это другой тип
+                    .str.strip()  # Удаляем пробелы в начале и конце
+                    .str.replace(' ',
+                                 '')  # Удаляем все пробелы (если нужно оставить десятичные пробелы, измените эту строку)
+                    .replace('', pd.NA)  # Пустые строки заменяем на NA
+                    .astype('float64')  # Преобразуем в float
+                )
+            except Exception as e:
+                print(f"Предупреждение: ячейка '{col}' содержит нечисловое значение")
+                continue
+        else:
+            print(f"Предупреждение: Колонка '{col}' не найдена в DataFrame")
+    return new_df
+
+
+def read_excel_sheets(file_path, all_sheets=True):
+    """
+    Однократно читает Excel-файл (xls/xlsx) в память без заголовков.
+
+    Параметры:
+    file_path (str): Путь к файлу Excel
+    all_sheets (bool): Читать все листы (для xls всегда читается только первый лист)
+
+    Возвращает:
+    list: Список DataFrame (по одному на лист) со значениями ячеек как object
+    """
+    if file_path.lower().endswith('.xls'):
+        return [pd.read_excel(file_path, header=None, engine='xlrd', dtype='object')]
+    elif file_path.lower().endswith('xlsx'):
+        sheets = pd.read_excel(file_path, sheet_name=None if all_sheets else 0,
+                               header=None, engine='openpyxl', dtype='object')
+        return list(sheets.values()) if all_sheets else [sheets]
+    raise ValueError(f"Неподдерживаемый формат файла: {file_path}")
+
+
+def stringify_sheet(df):
+    """
+    Ячейки листа как строки (NaN -> '') по столбцам: каждый столбец - отдельная
+    Series строк, без общей матрицы фиксированной ширины (её размер зависел бы
+    от самой длинной ячейки листа).
+
+    Возвращает:
+    list: Series строк, по одной на столбец листа
+    """
+    columns = []
+    for idx in range(df.shape[1]):
+        column = df.iloc[:, idx].astype('object')
+        columns.append(column.where(column.notna(), '').astype(str))
+    return columns
+
+
+def locate_tables_and_labels(df, labels=(), columns=None):
+    """
+    Векторизованный поиск границ таблиц и строк с реквизитами на листе.
+
+    Параметры:
+    df (pd.DataFrame): Лист без заголовков
+    labels (iterable): Метки реквизитов для поиска (без учёта регистра)
+    columns (list): Уже подготовленный stringify_sheet(df), чтобы не строить его повторно
+
+    Возвращает:
+    tuple: (список диапазонов таблиц (start, end), словарь {метка: [индексы строк]})
+    """
+    if df.empty:
+        return [], {label: [] for label in labels}
+
+    if columns is None:
+        columns = stringify_sheet(df)
+    n_rows = len(df)
+
+    # Строка заголовков содержит все первые шесть целевых заголовков
+    header_mask = np.ones(n_rows, dtype=bool)
+    for header in TARGET_HEADERS[:6]:
+        found = np.zeros(n_rows, dtype=bool)
+        for column in columns:
+            found |= (column == header).to_numpy()
+        header_mask &= found
+
+    blank_mask = np.ones(n_rows, dtype=bool)
+    for column in columns:
+        stripped = column.str.strip()
+        blank_mask &= ((stripped == '') | (stripped == 'nan')).to_numpy()
+
+    # Проходим только по строкам-событиям (заголовок или пустая строка)
+    tables = []
+    current_table_start = None
+    for row_idx in np.flatnonzero(header_mask | blank_mask):
+        row_idx = int(row_idx)
+        if header_mask[row_idx]:
+            if current_table_start is not None:
+                tables.append((current_table_start, row_idx - 1))
+            current_table_start = row_idx
+        elif current_table_start is not None:
+            tables.append((current_table_start, row_idx - 1))
+            current_table_start = None
+    if current_table_start is not None:
+        tables.append((current_table_start, n_rows - 1))
+
+    label_rows = {}
+    if labels:
+        lowered = [column.str.lower() for column in columns]
+        for label in labels:
+            hits = np.zeros(n_rows, dtype=bool)
+            for column in lowered:
+                hits |= column.str.contains(label.lower(), regex=False).to_numpy()
+            label_rows[label] = np.flatnonzero(hits).tolist()
+
+    return tables, label_rows
+
+
+class UpdWorkbook:
+    """
+    Разобранный в память файл УПД: все листы читаются один раз,
+    после чего поиск заголовков, вырезка таблиц и поиск реквизитов
+    выполняются без повторного чтения файла.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.sheets = read_excel_sheets(file_path)
+        # Реквизиты ищутся только на первом листе, как и раньше
+        self.meta_sheet = self.sheets[0].fillna('') if self.sheets else pd.DataFrame()
+        self._metadata = None
+        self._meta_columns = None
+
+    def text_columns(self, sheet_idx):
+        """
+        Строковые столбцы листа (stringify_sheet). Для первого листа кешируются:
+        он используется и для поиска таблиц, и для поиска реквизитов.
+        """
+        if sheet_idx != 0:
+            return stringify_sheet(self.sheets[sheet_idx])
+        if self._meta_columns is None:
+            self._meta_columns = stringify_sheet(self.meta_sheet)
+        return self._meta_columns
+
+    def find_rows(self, label):
+        """
+        Возвращает строки первого листа, содержащие label (без учёта регистра),
+        в формате [file_path, непустые ячейки...].
+        """
+        _, label_rows = locate_tables_and_labels(self.meta_sheet, [label], self.text_columns(0))
+        return [self.row_cells(row_idx) for row_idx in label_rows[label]]
+
+    def row_cells(self, row_idx):
+        """Строка первого листа в формате [file_path, непустые ячейки...]."""
+        row = self.meta_sheet.iloc[row_idx]
+        return [self.file_path] + [cell for cell in row if str(cell).strip() not in ('', 'nan')]
+
+    def metadata(self):
+        """
+        Реквизиты файла ((2), (2б), (5а)), найденные за один проход по листу.
+        Результат кешируется и используется для всех таблиц файла.
+        """
+        if self._metadata is None:
+            self._metadata = extract_upd_metadata(self)
+        return self._metadata
+
+    def slice_table(self, sheet_idx, start, end):
+        """
+        Вырезает таблицу из листа: строка start - заголовки,
+        строки start+1..end - данные. Оставляет только столбцы из TARGET_HEADERS.
+        """
+        sheet = self.sheets[sheet_idx]
+        header = [str(cell) for cell in sheet.iloc[start].values]
+        columns = []
+        names = []
+        for col_idx, name in enumerate(header):
+            if name in TARGET_HEADERS and name not in names:
+                columns.append(col_idx)
+                names.append(name)
+
+        data_df = sheet.iloc[start + 1:end + 1, columns].copy()
+        data_df.columns = names
+        return data_df.reset_index(drop=True)
+
+
+def extract_upd_metadata(workbook):
+    """
+    Извлекает все реквизиты файла за один проход по первому листу.
+
+    Все метки (основные DATA_TO_PARSE, запасные DATA_TO_PARSE_NO_INDEX и INVOICE_LABEL)
+    ищутся одновременно, после чего значения разрешаются по тем же правилам,
+    что и при поиске по одной метке.
+
+    Параметры:
+    workbook (UpdWorkbook): Разобранный файл
+
+    Возвращает:
+    dict: {столбец: значение}, например {'(2)': ..., '(2б)': ..., '(5а)': ...}
+    """
+    _, label_rows = locate_tables_and_labels(workbook.meta_sheet, METADATA_LABELS, workbook.text_columns(0))
+    first_rows = {label: workbook.row_cells(rows[0]) for label, rows in label_rows.items() if rows}
+    return resolve_upd_metadata(first_rows)
+
+
+def resolve_upd_metadata(first_rows):
+    """
+    Разрешает реквизиты по первым найденным строкам для каждой метки.
+
+    Параметры:
+    first_rows (dict): {метка: [file_path, непустые ячейки...]} для найденных меток
+
+    Возвращает:
+    dict: {столбец: значение}
+    """
+    def first_row(label):
+        # IndexError, если метка не найдена - как и при поштучном поиске
+        if label not in first_rows:
+            raise IndexError(f"метка '{label}' не найдена")
+        return first_rows[label]
+
+    metadata = {}
+    for primary, fallback in zip(DATA_TO_PARSE, DATA_TO_PARSE_NO_INDEX):
+        found = first_rows.get(primary[0])
+        if found and len(found) >= 4:
+            metadata[found[3]] = found[2]
+        else:
+            # Альтернативный поиск данных, если первый вариант не сработал
+            value = first_row(fallback[0])[2]
+            if 'тот' in value:
+                # Особый случай для определенного ключевого слова
+                value = first_row(INVOICE_LABEL)[2]
+            metadata[fallback[1]] = value
+
+    return metadata
+
+
+def parse_xls_xlsx_get_data(file_path, data_to_get, workbook=None):
+    if workbook is None:
+        try:
+            workbook = UpdWorkbook(file_path)
+        except Exception as e:
+            print(f"Ошибка при чтении файла: {e}")
+            return
+
+    return workbook.find_rows(data_to_get[0])
+
+
+def replace_missing_country(csv_file_path, column_name, new_value):
+    df = read_table(csv_file_path, schema=COLUMN_SCHEMA)
+    missing = df[column_name].isin(['----', '--', '-'])
+    df[column_name] = df[column_name].astype('object').where(~missing, new_value)
+    write_table(apply_schema(df), csv_file_path, encoding='utf-8', schema=COLUMN_SCHEMA)
+
+
+def save_to_csv(data_df, output_file="результат.csv"):
+    try:
+        # Добавляем новый столбец
+        if 'А' in data_df.columns:
+
+            data_df.insert(1, clean_number,
+                           data_df['А'].astype('object').str.replace('[@-]', '', regex=True).str.strip())
+
+        # Приводим к нужному порядку столбцов и типам схемы
+        data_df = apply_schema(data_df.reindex(columns=COLUMN_ORDER))
+
+        # Сохраняем
+        data_df.to_csv(output_file, index=False, encoding='utf-8-sig')
+        print(f"✅ Таблица успешно сохранена в файл: {output_file}")
+
+    except Exception as e:
+        print(f"❌ Ошибка при сохранении: {e}")
+
+
+def prepare_tables(tables, columns=COLUMN_ORDER):
+    """
+    Объединяет извлечённые таблицы, добавляет столбец clean_number
+    и приводит к порядку COLUMN_ORDER одной операцией на всю партию.
+    Типы столбцов уже заданы при извлечении, здесь восстанавливаются только
+    категории, которые pd.concat превращает в object при разных наборах значений.
+
+    Параметры:
+    tables (list): Список DataFrame из find_and_extract_tables
+    columns (list): Итоговый набор и порядок столбцов
+
+    Возвращает:
+    pd.DataFrame: Таблица со столбцами columns
+    """
+    if not tables:
+        return pd.DataFrame(columns=columns)
+
+    data_df = pd.concat(tables, ignore_index=True)
+    if 'А' in data_df.columns:
+        data_df[clean_number] = data_df['А'].astype('object').str.replace('[@-]', '', regex=True).str.strip()
+
+    return apply_schema(data_df.reindex(columns=columns))
+
+
+class TableAccumulator:
+    """
+    Накопитель извлечённых таблиц в памяти вместо записи temp-файла
+    и перезаписи целевого CSV после каждой таблицы.
+
+    Итоговый файл (CSV, Parquet или Feather) записывается один раз в finalize().
+    Если задан spill_rows, накопленные строки сбрасываются в целевой CSV
+    партиями дозаписью, без повторного чтения уже записанного.
+    """
+
+    def __init__(self, target_path, spill_rows=None, columns=COLUMN_ORDER):
+        if spill_rows and table_format(target_path) != 'csv':
+            raise ValueError("Сброс партиями (spill_rows) поддерживается только для CSV")
+        self.target_path = target_path
+        self.spill_rows = spill_rows
+        self.columns = columns
+        self.tables = []
+        self.buffered_rows = 0
+        self.tables_added = 0
+        self.rows_written = 0
+        self._started = False
+
+    def add(self, table):
+        self.tables.append(table)
+        self.buffered_rows += len(table)
+        self.tables_added += 1
+        if self.spill_rows and self.buffered_rows >= self.spill_rows:
+            self._flush()
+
+    def _flush(self):
+        batch = prepare_tables(self.tables, self.columns)
+
+        if not self._started:
+            # Как и раньше, строки дописываются к уже существующему целевому файлу
+            if os.path.exists(self.target_path):
+                existing = read_table(self.target_path, schema=COLUMN_SCHEMA)
+                if not existing.empty:
+                    batch = apply_schema(pd.concat([existing.reindex(columns=self.columns), batch],
+                                                   ignore_index=True))
+            write_table(batch, self.target_path, encoding='utf-8-sig', schema=COLUMN_SCHEMA)
+            self._started = True
+        else:
+            batch.to_csv(self.target_path, mode='a', header=False, index=False, encoding='utf-8')
+
+        self.rows_written += len(batch)
+        self.tables = []
+        self.buffered_rows = 0
+
+    def finalize(self):
+        """Записывает оставшиеся таблицы и возвращает путь к целевому файлу."""
+        if self.tables or not self._started:
+            self._flush()
+        print(f"✅ Успешно объединено {self.tables_added} таблиц ({self.rows_written} записей) в {self.target_path}")
+        return self.target_path
+
+
+class ExtractionManifest:
+    """
+    Манифест обработанных файлов УПД для инкрементальных запусков.
+
+    Рядом с целевым файлом хранятся:
+    - <target>.manifest.json - путь -> размер, mtime, число строк и имя партиции;
+    - <target>.extracted/ - извлечённые строки, по одной партиции на исходный файл
+      в формате целевого файла (Parquet, Feather или CSV).
+
+    При повторном запуске разбираются только новые и изменённые файлы,
+    партиции изменённых и удалённых файлов удаляются.
+    """
+
+    def __init__(self, target_path):
+        base_path = os.path.splitext(target_path)[0]
+        self.store_format = table_format(target_path)
+        self.manifest_path = base_path + ".manifest.json"
+        self.store_dir = base_path + ".extracted"
+        self.files = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding='utf-8') as f:
+                self.files = json.load(f).get("files", {})
+
+    def _partition_name(self, file_path):
+        digest = hashlib.md5(file_path.encode('utf-8')).hexdigest()[:12]
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        return f"{base_name}_{digest}.{self.store_format}"
+
+    def plan(self, excel_files):
+        """
+        Сравнивает текущие файлы с манифестом и удаляет устаревшие партиции.
+
+        Возвращает:
+        list: Файлы, которые нужно разобрать (новые и изменённые)
+        """
+        to_process = []
+        for file_path in excel_files:
+            entry = self.files.get(file_path)
+            signature = file_signature(file_path)
+            if entry is None or {k: entry.get(k) for k in signature} != signature:
+                to_process.append(file_path)
+
+        current = set(excel_files)
+        removed = [file_path for file_path in self.files if file_path not in current]
+        for file_path in set(to_process) | set(removed):
+            entry = self.files.pop(file_path, None)
+            if entry and entry.get("partition"):
+                partition_path = os.path.join(self.store_dir, entry["partition"])
+                if os.path.exists(partition_path):
+                    os.remove(partition_path)
+
+        print(f"Инкрементальный запуск: {len(to_process)} новых/изменённых файлов, "
+              f"{len(excel_files) - len(to_process)} без изменений, {len(removed)} удалено")
+        return to_process
+
+    def record(self, file_path, tables):
+        """Записывает партицию с таблицами файла и отмечает файл в манифесте."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        partition = self._partition_name(file_path)
+        data_df = prepare_tables(tables)
+        write_table(data_df, os.path.join(self.store_dir, partition), encoding='utf-8-sig', schema=COLUMN_SCHEMA)
+
+        entry = file_signature(file_path)
+        entry["tables"] = len(tables)
+        entry["rows"] = len(data_df)
+        entry["partition"] = partition
+        self.files[file_path] = entry
+
+    def commit(self, target_path):
+        """Сохраняет манифест и собирает партиции в целевой файл в порядке имён исходных файлов."""
+        with open(self.manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=2)
+
+        parts = [read_table(os.path.join(self.store_dir, self.files[file_path]["partition"]), schema=COLUMN_SCHEMA)
+                 for file_path in sorted(self.files)]
+        parts = [part for part in parts if not part.empty]
+        data_df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=COLUMN_ORDER)
+        write_table(apply_schema(data_df.reindex(columns=COLUMN_ORDER)), target_path, encoding='utf-8-sig',
+                    schema=COLUMN_SCHEMA)
+        print(f"✅ Собрано {len(data_df)} записей из {len(parts)} партиций в {target_path}")
+        return target_path
+
+
+def clean_extracted_table(data_df):
+    """Удаляет строки без значения в 6-й колонке и полностью пустые строки."""
+    # Удаляем строки, где 4-я колонка пустая
+    if len(data_df.columns) >= 6:  # Проверяем, что в DF есть хотя бы 4 колонки
+        data_df = data_df[data_df[data_df.columns[5]].notna()]  # Удаляем пустые
+
+    return data_df.dropna(how='all')  # Удаляем полностью пустые строки
+
+
+# Строки, которые pd.read_excel превращает в NaN (na_values по умолчанию)
+EXCEL_NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+} | set(ERROR_CODES)
+
+
+def excel_cell_value(value):
+    """Значение ячейки openpyxl в том виде, в каком его возвращает pd.read_excel(dtype='object')."""
+    if value is None:
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in EXCEL_NA_STRINGS:
+        return np.nan
+    return value
+
+
+def stream_extract_tables(file_path, errors=None):
+    """
+    Потоковое извлечение таблиц из xlsx через openpyxl в режиме read-only.
+
+    Строки листа просматриваются по одной: заголовки таблиц и метки реквизитов
+    распознаются на лету, в память попадают только строки внутри найденных таблиц
+    и только столбцы из TARGET_HEADERS. Результат совпадает с find_and_extract_tables.
+
+    Параметры:
+    file_path (str): Путь к xlsx-файлу
+    errors (list): Если передан, сюда добавляются ошибки обработки отдельных таблиц
+
+    Возвращает:
+    list: Список DataFrame с извлеченными таблицами
+    """
+    first_rows = {}  # Первая строка для каждой метки реквизитов (только первый лист)
+    raw_tables = []  # Найденные таблицы: диапазон, столбцы и строки
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        for sheet_idx, ws in enumerate(workbook.worksheets):
+            ws.reset_dimensions()  # Размеры в read-only режиме могут быть указаны неверно
+            current = None
+            row_idx = -1
+
+            for row_idx, row in enumerate(ws.iter_rows(values_only=True)):
+                values = [excel_cell_value(cell) for cell in row]
+                strings = ['' if pd.isna(cell) else str(cell) for cell in values]
+                row_values = [text for text in strings if text.strip() not in ('', 'nan')]
+
+                if sheet_idx == 0 and row_values:
+                    row_str = '|'.join(strings).lower()
+                    for label in METADATA_LABELS:
+                        if label not in first_rows and label.lower() in row_str:
+                            first_rows[label] = [file_path] + [cell for cell, text in zip(values, strings)
+                                                               if text.strip() not in ('', 'nan')]
+
+                if all(header in row_values for header in TARGET_HEADERS[:6]):
+                    if current is not None:
+                        current["end"] = row_idx - 1
+                        raw_tables.append(current)
+                    columns, names = [], []
+                    for col_idx, name in enumerate(strings):
+                        if name in TARGET_HEADERS and name not in names:
+                            columns.append(col_idx)
+                            names.append(name)
+                    current = {"start": row_idx, "columns": columns, "names": names, "rows": []}
+                elif current is not None and not row_values:
+                    current["end"] = row_idx - 1
+                    raw_tables.append(current)
+                    current = None
+                elif current is not None:
+                    current["rows"].append([values[col] if col < len(values) else np.nan
+                                            for col in current["columns"]])
+
+            if current is not None:
+                current["end"] = row_idx
+                raw_tables.append(current)
+    finally:
+        workbook.close()
+
+    all_tables = []
+    for table in raw_tables:
+        try:
+            data_df = pd.DataFrame(table["rows"], columns=table["names"], dtype='object')
+            data_df = clean_extracted_table(data_df)
+
+            for column, value in resolve_upd_metadata(first_rows).items():
+                data_df[column] = value
+
+            # Типы столбцов задаются один раз здесь и дальше только сохраняются
+            all_tables.append(apply_schema(data_df, parse=True))
+
+        except Exception as e:
+            print(f"Ошибка при обработке таблицы (строки {table['start']}-{table['end']}): {e}")
+            if errors is not None:
+                errors.append(f"таблица (строки {table['start']}-{table['end']}): {e}")
+
+    return all_tables
+
+
+def find_and_extract_tables(file_path, streaming=False, errors=None):
+    """
+    Функция для поиска и извлечения таблиц из Excel-файла (xls/xlsx) по заданным заголовкам.
+
+    Параметры:
+    file_path (str): Путь к файлу Excel для обработки
+    streaming (bool): Для xlsx - потоковое чтение без загрузки листов целиком (stream_extract_tables)
+    errors (list): Если передан, сюда добавляются ошибки обработки отдельных таблиц
+
+    Возвращает:
+    list: Список DataFrame с извлеченными таблицами
+
+    Логика работы:
+    1. Однократное чтение файла Excel (всех листов для xlsx) в UpdWorkbook
+    2. Поиск таблиц по совпадению целевых заголовков
+    3. Извлечение и очистка найденных таблиц
+    4. Добавление дополнительных данных из файла
+    5. Приведение столбцов к типам COLUMN_SCHEMA
+    """
+    print(f"Обработка файла: {file_path}")
+
+    if streaming and file_path.lower().endswith('xlsx'):
+        return stream_extract_tables(file_path, errors)
+
+    # Файл читается один раз, дальше вся работа идёт в памяти
+    workbook = UpdWorkbook(file_path)
+
+    all_tables = []  # Список для хранения всех найденных таблиц
+
+    # Обработка каждого листа/DataFrame
+    for sheet_idx, df in enumerate(workbook.sheets):
+        # Диапазоны таблиц находятся одним проходом по всему листу
+        tables_in_sheet, _ = locate_tables_and_labels(df, columns=workbook.text_columns(sheet_idx))
+
+        # Извлечение данных для каждой найденной таблицы
+        for start, end in tables_in_sheet:
+            try:
+                # Вырезаем таблицу с нужными колонками из уже прочитанного листа
+                data_df = workbook.slice_table(sheet_idx, start, end)
+
+                # Очистка данных
+                data_df = clean_extracted_table(data_df)
+
+                # Добавление дополнительных данных из файла (реквизиты ищутся один раз на файл)
+                for column, value in workbook.metadata().items():
+                    data_df[column] = value
+
+                # Типы столбцов (COLUMN_SCHEMA) задаются один раз здесь и дальше только сохраняются
+                all_tables.append(apply_schema(data_df, parse=True))  # Добавляем обработанную таблицу в результат
+
+            except Exception as e:
+                print(f"Ошибка при обработке таблицы (строки {start}-{end}): {e}")
+                if errors is not None:
+                    errors.append(f"таблица (строки {start}-{end}): {e}")
+
+    return all_tables
+
+
+def _extract_file(file_path, streaming=False):
+    """
+    Обработка одного файла (в т.ч. в дочернем процессе): ошибка возвращается, а не пробрасывается.
+    Вместе с таблицами возвращаются метрики файла: время, размер, ошибки отдельных таблиц.
+    """
+    table_errors = []
+    start = time.perf_counter()
+    try:
+        tables, error = find_and_extract_tables(file_path, streaming, table_errors), None
+    except Exception as e:
+        tables, error = [], str(e)
+    stats = {
+        "seconds": round(time.perf_counter() - start, 4),
+        "bytes_read": file_size(file_path),
+        "table_errors": table_errors,
+    }
+    return file_path, tables, error, stats
+
+
+def extract_tables_from_files(excel_files, jobs=1, streaming=False):
+    """
+    Извлекает таблицы из списка файлов последовательно или в пуле процессов.
+
+    Параметры:
+    excel_files (list): Пути к файлам УПД
+    jobs (int): Количество процессов (1 - без пула, 0 - по числу ядер)
+    streaming (bool): Потоковое чтение xlsx (см. stream_extract_tables)
+
+    Возвращает:
+    generator: Кортежи (file_path, tables, error, stats) в порядке имён файлов,
+    stats - метрики файла (seconds, bytes_read, table_errors)
+    """
+    excel_files = sorted(excel_files)
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if jobs <= 1 or len(excel_files) <= 1:
+        for file_path in excel_files:
+            yield _extract_file(file_path, streaming)
+        return
+
+    # map возвращает результаты в порядке входного списка
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(partial(_extract_file, streaming=streaming), excel_files)
+
+
+def write_xlsx_streaming(df, xlsx_file_path, max_rows=EXCEL_MAX_ROWS, chunksize=10000):
+    """
+    Записывает DataFrame в XLSX через write-only книгу openpyxl: строки пишутся
+    в файл потоком, без построения модели ячеек в памяти.
+
+    Числа остаются числами, NaN - пустыми ячейками. При достижении max_rows
+    начинается новый лист (Sheet2, Sheet3, ...) с повтором строки заголовков.
+
+    Возвращает:
+    - int - количество листов
+    """
+    wb = Workbook(write_only=True)
+    sheets = RolloverSheets(df.columns, wb, max_rows)
+
+    for chunk_start in range(0, len(df), chunksize):
+        chunk = df.iloc[chunk_start:chunk_start + chunksize]
+        chunk = chunk.astype('object').where(chunk.notna(), None)
+        for row in chunk.itertuples(index=False, name=None):
+            sheets.append(row)
+
+    # Пустая таблица - только заголовки
+    sheet_count = len(sheets.close())
+    wb.save(xlsx_file_path)
+    return sheet_count
+
+
+def csv_to_xlsx(csv_file_path, xlsx_file_path=None, write_only=False, max_rows=EXCEL_MAX_ROWS):
+    """
+    Конвертирует CSV-файл (или Parquet/Feather) в XLSX-файл.
+
+    Параметры:
+    - csv_file_path: str - путь к исходному CSV/Parquet/Feather-файлу
+    - xlsx_file_path: str (опциональный) - путь для сохранения XLSX-файла.
+      Если не указан, будет использовано то же имя файла, что у CSV, но с расширением .xlsx
+    - write_only: bool - потоковая запись (write_xlsx_streaming) с переходом на новый лист
+      после max_rows строк; время и память растут линейно с числом строк
+
+    Возвращает:
+    - str - путь к сохранённому XLSX-файлу
+    """
+    # Читаем CSV-файл (или Parquet/Feather). Для промежуточных файлов пайплайна суммы и цены
+    # уже числовые; в произвольном CSV они могут быть строками с пробелами и разбираются здесь
+    df = apply_schema(read_table(csv_file_path, schema=EXPORT_SCHEMA), EXPORT_SCHEMA, parse=True)
+
+    # Если путь для XLSX не указан, создаём его из пути CSV
+    if xlsx_file_path is None:
+        if table_format(csv_file_path) != 'csv' or csv_file_path.lower().endswith('.csv'):
+            xlsx_file_path = os.path.splitext(csv_file_path)[0] + '.xlsx'
+        else:
+            xlsx_file_path = csv_file_path + '.xlsx'
+
+    # Сохраняем в XLSX
+    if write_only:
+        write_xlsx_streaming(df, xlsx_file_path, max_rows=max_rows)
+    else:
+        df.to_excel(xlsx_file_path, index=False, engine='openpyxl')
+
+    return xlsx_file_path
+
+
+def xlsx_to_csv(xlsx_file_path, csv_file_path=None, sheet_name=0, delimiter=','):
+    """
+    Конвертирует XLSX-файл в CSV.
+
+    Параметры:
+    - xlsx_file_path: str - путь к исходному XLSX-файлу.
+    - csv_file_path: str (опциональный) - путь для сохранения CSV.
+      Если не указан, будет использовано то же имя, что у XLSX, но с расширением .csv.
+    - sheet_name: str/int (опциональный) - имя или номер листа в XLSX (по умолчанию первый лист).
+    - delimiter: str (опциональный) - разделитель для CSV (по умолчанию ',').
+
+    Возвращает:
+    - str - путь к сохранённому CSV-файлу.
+    """
+    # Читаем XLSX-файл
+    df = pd.read_excel(xlsx_file_path, sheet_name=sheet_name)
+
+    # Если путь для CSV не указан, создаём его из пути XLSX
+    if csv_file_path is None:
+        if xlsx_file_path.lower().endswith('.xlsx'):
+            csv_file_path = xlsx_file_path[:-4] + 'csv'
+        else:
+            csv_file_path = xlsx_file_path + '.csv'
+
+    # Сохраняем в CSV
+    df.to_csv(csv_file_path, index=False, sep=delimiter)
+
+    return csv_file_path
+
+
+def xls_to_csv(xls_file_path, csv_file_path=None, sheet_name=0, delimiter=','):
+    """
+    Устойчивая конвертация XLS/XLSX в CSV с автоматическим выбором движка.
+    """
+    try:
+        # Пробуем openpyxl для XLSX
+        df = pd.read_excel(xls_file_path, sheet_name=sheet_name, engine='openpyxl')
+    except:
+        try:
+            # Пробуем xlrd для старых XLS
+            df = pd.read_excel(xls_file_path, sheet_name=sheet_name, engine='xlrd')
+        except Exception as e:
+            raise ValueError(f"Не удалось прочитать файл: {str(e)}")
+
+    if csv_file_path is None:
+        csv_file_path = xls_file_path.rsplit('.', 1)[0] + '.csv'
+
+    df.to_csv(csv_file_path, index=False, sep=delimiter)
+    return csv_file_path
+
+
+def load_tnved_reference(folder_spravochnik_tnved="tnved"):
+    """Загружает индекс справочника ТН ВЭД (первый xlsx в папке); индекс берётся из кеша, пока xlsx не изменится."""
+    folder_spravochnik_tnved_xlsx = glob(os.path.join(folder_spravochnik_tnved, "*.xlsx"))[0]
+    return load_tnved_index(folder_spravochnik_tnved_xlsx)
+
+
+def build_arg_parser(description="Извлечение таблиц из УПД и сборка итогового файла"):
+    """Общие параметры командной строки для main_*.py и пакетного запуска."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Количество процессов для разбора файлов (0 - по числу ядер)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Разбирать только новые и изменённые файлы (манифест рядом с итоговым файлом)")
+    parser.add_argument("--store-format", choices=('csv',) + COLUMNAR_FORMATS, default=DEFAULT_STORE_FORMAT,
+                        help="Формат промежуточных данных (CSV/XLSX выгружается только в конце)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Потоковое чтение xlsx без загрузки листов целиком")
+    parser.add_argument("--fast-export", action="store_true",
+                        help="Потоковая запись итогового xlsx (write-only, новый лист после 1 048 576 строк)")
+    parser.add_argument("--report", metavar="JSON", default=None,
+                        help="Сохранить отчёт о запуске (время этапов, строки, байты, совпадения, ошибки) в JSON")
+    parser.add_argument("--progress", action="store_true",
+                        help="Показывать строку прогресса с оценкой оставшегося времени")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="Профилировать этапы (cProfile + tracemalloc): профили и сводка в папку DIR")
+    parser.add_argument("--profile-top", type=int, default=20, help="Сколько горячих точек выводить в сводке")
+    return parser
+
+
+def run_entity(folder_path, folder_report_abcp, target_name, tnved_index=None, jobs=1,
+               incremental=False, store_format=DEFAULT_STORE_FORMAT, streaming=False, fast_export=False,
+               report=None, progress=False):
+    """
+    Полный цикл обработки одного юрлица: УПД -> таблицы -> ТН ВЭД -> страна -> ABCP -> XLSX.
+
+    Параметры:
+    folder_path (str): Папка с файлами УПД
+    folder_report_abcp (str): Папка с отчётом ABCP (*.xls)
+    target_name (str): Имя итогового файла без расширения
+    tnved_index (pd.Series): Индекс ТН ВЭД (если не передан, загружается из папки tnved)
+    jobs (int): Количество процессов для разбора файлов
+    incremental (bool): Разбирать только новые и изменённые файлы
+    store_format (str): Формат промежуточных данных
+    streaming (bool): Потоковое чтение xlsx
+    fast_export (bool): Потоковая запись итогового xlsx
+    report (RunReport): Куда записывать метрики этапов и файлов (см. run_report)
+    progress (bool): Показывать строку прогресса разбора файлов с оценкой оставшегося времени
+
+    Возвращает:
+    str: Путь к итоговому XLSX-файлу
+    """
+    report = report or RunReport(target_name)
+
+    with report.stage("references") as stage:
+        report_abcp_xls = glob(os.path.join(folder_report_abcp, "*.xls"))[0]
+        # Отчёт читается напрямую, повторные запуски берут его из кеша
+        report_abcp = load_abcp_report(report_abcp_xls)
+        if tnved_index is None:
+            tnved_index = load_tnved_reference()
+        stage["bytes_read"] = file_size(report_abcp_xls)
+        stage["abcp_rows"] = len(report_abcp)
+        stage["tnved_keys"] = len(tnved_index)
+    target_path = f"{target_name}.{store_format}"
+
+    excel_files = glob(os.path.join(folder_path, "*.xls*"))
+
+    with report.stage("extract", files=len(excel_files)) as stage:
+        # Таблицы накапливаются в памяти, промежуточный файл пишется один раз
+        if incremental:
+            manifest = ExtractionManifest(target_path)
+            files_to_process = manifest.plan(excel_files)
+        else:
+            manifest = None
+            files_to_process = excel_files
+            accumulator = TableAccumulator(target_path)
+
+        progress_line = ProgressLine(len(files_to_process), "Разбор УПД", enabled=progress)
+        for file, tables, error, stats in extract_tables_from_files(files_to_process, jobs, streaming):
+            progress_line.update(info=os.path.basename(file))
+            report.file(file, tables=len(tables), rows=sum(len(table) for table in tables), **stats)
+            for table_error in stats["table_errors"]:
+                report.error("extract", table_error, file)
+
+            if error:
+                report.error("extract", error, file)
+                print(f"❌ Ошибка при обработке файла {file}: {error}")
+                continue
+
+            if manifest:
+                manifest.record(file, tables)
+                continue
+
+            for i, table in enumerate(tables, 1):
+                print(f"Обработка таблицы {i} из файла {file}")
+                accumulator.add(table)
+        progress_line.close()
+
+        if manifest:
+            manifest.commit(target_path)
+        else:
+            accumulator.finalize()
+
+        stage["files_processed"] = len(files_to_process)
+        stage["tables"] = sum(entry["tables"] for entry in report.files)
+        stage["rows"] = sum(entry["rows"] for entry in report.files)
+        stage["bytes_read"] = sum(entry["bytes_read"] for entry in report.files)
+        stage["bytes_written"] = file_size(target_path)
+
+    # добавляем коды ТН ВЭД
+    with report.stage("tnved") as stage:
+        result = merge_csv_preserve_headers(target_path, None, target_path, value_index=tnved_index)
+        stage["rows"] = len(result)
+        stage["match_rate"] = round(float(result.attrs["match_rate"]), 4)
+
+    # подставляем Россия в страну
+    with report.stage("country"):
+        replace_missing_country(target_path, "10а", "РОССИЯ")
+
+    # добавляем данные из REPORT ABCP
+    with report.stage("abcp") as stage:
+        result = merge_csv_files(target_path, report_abcp_xls, report_df=report_abcp)
+        stage["rows"] = len(result)
+        stage["match_rate"] = round(float(result.attrs["match_rate"]), 4)
+
+    # CSV/XLSX выгружается только на последнем шаге
+    with report.stage("export") as stage:
+        stage["bytes_read"] = file_size(target_path)
+        xlsx_path = csv_to_xlsx(target_path, f"{target_name}.xlsx", write_only=fast_export)
+        stage["bytes_written"] = file_size(xlsx_path)
+
+    os.remove(target_path)
+
+    return xlsx_path
@@ -0,0 +1,67 @@
+from openpyxl.cell.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+# Максимум строк на листе Excel (включая строку заголовков)
+EXCEL_MAX_ROWS = 1048576
+
+HEADER_FONT = Font(bold=True)
+
+
+def header_cells(ws, names, font=HEADER_FONT):
+    """Строка заголовков для ws.append: ячейки с шрифтом font (без font - просто строки)."""
+    if font is None:
+        return [str(name) for name in names]
+    cells = []
+    for name in names:
+        cell = WriteOnlyCell(ws, value=str(name))
+        cell.font = font
+        cells.append(cell)
+    return cells
+
+
+class RolloverSheets:
+    """
+    Запись строк таблицы на листы книги с переходом на новый лист.
+
+    Каждый лист начинается со строки заголовков header (жирной, если не задан
+    другой header_font). После max_rows строк (включая заголовок, не больше
+    EXCEL_MAX_ROWS) или по сигналу full в append начинается новый лист.
+    Листы создаются через create_sheet(номер) - по умолчанию Sheet1, Sheet2, ... в wb.
+    Подходит и для write-only книг: строки пишутся сразу, без модели ячеек.
+    """
+
+    def __init__(self, header, wb=None, max_rows=EXCEL_MAX_ROWS, header_font=HEADER_FONT, create_sheet=None):
+        self.header = list(header)
+        self.header_font = header_font
+        self.rows_per_sheet = min(max_rows or EXCEL_MAX_ROWS, EXCEL_MAX_ROWS) - 1
+        self.create_sheet = create_sheet or (lambda number: wb.create_sheet(f"Sheet{number}"))
+        self.sheets = []
+        self.rows_in_sheet = 0
+
+    def new_sheet(self):
+        ws = self.create_sheet(len(self.sheets) + 1)
+        ws.append(header_cells(ws, self.header, self.header_font))
+        self.sheets.append(ws)
+        self.rows_in_sheet = 0
+        return ws
+
+    def append(self, row, fill=None, full=False):
+        """Дописывает строку (с заливкой всех ячеек fill); full=True - начать новый лист."""
+        if not self.sheets or full or self.rows_in_sheet >= self.rows_per_sheet:
+            self.new_sheet()
+        ws = self.sheets[-1]
+        if fill is not None:
+            cells = []
+            for value in row:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.fill = fill
+                cells.append(cell)
+            row = cells
+        ws.append(row)
+        self.rows_in_sheet += 1
+
+    def close(self):
+        """Гарантирует хотя бы один лист (пустая таблица - только заголовки) и возвращает листы."""
+        if not self.sheets:
+            self.new_sheet()
+        return self.sheets
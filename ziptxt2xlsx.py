@@ -1,51 +1,417 @@
+import argparse
+import csv
+import gzip
+import io
 import os
+import re
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
 from openpyxl import Workbook
 
+from run_report import StageProfiler, profiled
+from xlsx_writer import EXCEL_MAX_ROWS, RolloverSheets
 
-def process_zip_files():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
+WIDTH_SAMPLE_ROWS = 1000
 
-    for zip_file in os.listdir(script_dir):
-        if zip_file.endswith('.zip'):
-            zip_path = os.path.join(script_dir, zip_file)
-            zip_name = os.path.splitext(zip_file)[0]
+# Форматы результата: xlsx (по умолчанию) или таблицы без Excel
+OUTPUT_FORMATS = ('xlsx', 'csv.gz', 'parquet')
+PARQUET_CHUNK_ROWS = 100000
 
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    for file_info in zip_ref.infolist():
-                        if file_info.filename.endswith('.txt') and not file_info.is_dir():
-                            txt_name = os.path.splitext(file_info.filename)[0]
+# Столбец считается числовым, если все его непустые значения подходят под шаблон.
+# Значения с ведущими нулями (коды ТН ВЭД и т.п.) и длиннее 18 цифр остаются строками.
+INT_PATTERN = r'^-?(0|[1-9]\d{0,17})$'
+FLOAT_PATTERN = r'^-?(0|[1-9]\d*)(\.\d+)?$'
 
-                            wb = Workbook()
-                            ws = wb.active
-                            ws.title = txt_name[:30]
 
-                            with zip_ref.open(file_info) as txt_file:
-                                content = txt_file.read().decode('utf-8').splitlines()
+class ColumnWidths:
+    """
+    Максимальная длина значений по столбцам, накапливаемая при добавлении строк.
 
-                                for line in content:
-                                    if line.strip():
-                                        columns = line.split('\t')
-                                        ws.append(columns)
+    Позволяет подобрать ширину столбцов без второго прохода по листу.
+    Если задан sample_rows, учитываются только первые sample_rows строк.
+    """
 
-                            for col in ws.columns:
-                                max_length = 0
-                                for cell in col:
-                                    try:
-                                        if len(str(cell.value)) > max_length:
-                                            max_length = len(str(cell.value))
-                                    except:
-                                        pass
-                                adjusted_width = (max_length + 2)
-                                ws.column_dimensions[get_column_letter(col[0].column)].width = adjusted_width
+    def __init__(self, sample_rows=None):
+        self.sample_rows = sample_rows
+        self.rows_seen = 0
+        self.max_lengths = []
 
-                            output_path = os.path.join(script_dir, f"{zip_name}.xlsx")
-                            wb.save(output_path)
-                            print(f"Данные из {file_info.filename} сохранены в {output_path}")
+    def update(self, columns):
+        if self.sample_rows is not None and self.rows_seen >= self.sample_rows:
+            return
+        self.rows_seen += 1
+        if len(columns) > len(self.max_lengths):
+            self.max_lengths.extend([0] * (len(columns) - len(self.max_lengths)))
+        for idx, value in enumerate(columns):
+            length = len(str(value))
+            if length > self.max_lengths[idx]:
+                self.max_lengths[idx] = length
 
-            except zipfile.BadZipFile:
-                print(f"Ошибка: файл {zip_file} не является ZIP-архивом или поврежден")
+    def apply(self, ws):
+        """Проставляет ширину столбцов листу (для write-only листа - до первой строки)."""
+        for idx, max_length in enumerate(self.max_lengths, start=1):
+            ws.column_dimensions[get_column_letter(idx)].width = max_length + 2
+
+
+def iter_member_rows(zip_ref, file_info, encoding='utf-8'):
+    """
+    Построчно читает txt из архива, не распаковывая его целиком в память.
+
+    Файл декодируется потоком (io.TextIOWrapper), пустые строки пропускаются,
+    каждая строка разбивается по табуляции.
+    """
+    with zip_ref.open(file_info) as raw_file:
+        with io.TextIOWrapper(raw_file, encoding=encoding) as txt_file:
+            for line in txt_file:
+                line = line.rstrip('\r\n')
+                if line.strip():
+                    yield line.split('\t')
+
+
+def read_member_rows(zip_ref, file_info, encoding='utf-8'):
+    """Читает txt из архива целиком и возвращает непустые строки, разбитые по табуляции."""
+    with zip_ref.open(file_info) as txt_file:
+        content = txt_file.read().decode(encoding).splitlines()
+
+    for line in content:
+        if line.strip():
+            yield line.split('\t')
+
+
+class XlsxParts:
+    """
+    Книга с листами txt одного архива, разбиваемая на части по лимиту.
+
+    Часть заполняется, пока не достигнут лимит строк max_rows (не больше
+    EXCEL_MAX_ROWS) или объём исходного текста max_bytes. Затем начинается
+    новый лист {title}_2, {title}_3, ... (split='sheet') или новая книга
+    {zip_name}_2.xlsx, ... (split='workbook'). В режиме 'sheet' лимит действует
+    на лист, в режиме 'workbook' - на книгу. Первая строка txt (заголовок)
+    повторяется в начале каждой части.
+
+    В потоковом режиме книги write-only, а ширина столбцов подбирается по
+    первым width_sample строкам (они буферизуются до записи). В обычном режиме
+    ширина считается по всем строкам (или первым width_sample) по ходу записи.
+    """
+
+    def __init__(self, output_dir, zip_name, streaming=False, width_sample=None, split='sheet',
+                 max_rows=EXCEL_MAX_ROWS, max_bytes=None):
+        self.output_dir = output_dir
+        self.zip_name = zip_name
+        self.streaming = streaming
+        self.width_sample = width_sample
+        self.split = split
+        self.max_rows = min(max_rows or EXCEL_MAX_ROWS, EXCEL_MAX_ROWS)
+        self.max_bytes = max_bytes
+        self.saved_paths = []
+        self.wb = None
+        self.workbook_count = 0
+        self.sheets_in_workbook = 0
+        self.rows_in_part = 0
+        self.bytes_in_part = 0
+
+    def _new_workbook(self):
+        if self.wb is not None:
+            self._save()
+        self.workbook_count += 1
+        self.wb = Workbook(write_only=self.streaming)
+        self.sheets_in_workbook = 0
+        self.rows_in_part = 0
+        self.bytes_in_part = 0
+
+    def _save(self):
+        name = self.zip_name if self.workbook_count == 1 else f"{self.zip_name}_{self.workbook_count}"
+        output_path = os.path.join(self.output_dir, f"{name}.xlsx")
+        self.wb.save(output_path)
+        self.saved_paths.append(output_path)
+        print(f"Книга сохранена в {output_path} ({self.sheets_in_workbook} лист.)")
+
+    def _new_sheet(self, title, widths):
+        if self.wb is None:
+            self._new_workbook()
+        if self.streaming:
+            ws = self.wb.create_sheet(title)
+            widths.apply(ws)
+        else:
+            ws = self.wb.active if self.sheets_in_workbook == 0 else self.wb.create_sheet()
+            ws.title = title
+        self.sheets_in_workbook += 1
+        if self.split == 'sheet':
+            self.rows_in_part = 0
+            self.bytes_in_part = 0
+        return ws
+
+    def _part_full(self, size):
+        if self.rows_in_part >= self.max_rows:
+            return True
+        # Часть из одного заголовка не закрываем, даже если строка больше лимита
+        return bool(self.max_bytes) and self.rows_in_part > 1 and self.bytes_in_part + size > self.max_bytes
+
+    def _row_size(self, columns):
+        return len('\t'.join(columns).encode('utf-8')) + 1 if self.max_bytes else 0
+
+    def add_member(self, title, rows):
+        """Записывает строки одного txt на лист (листы) и возвращает их названия."""
+        if self.streaming:
+            sample = list(islice(rows, self.width_sample or WIDTH_SAMPLE_ROWS))
+            widths = ColumnWidths()
+            for columns in sample:
+                widths.update(columns)
+            rows = chain(sample, rows)
+        else:
+            widths = ColumnWidths(sample_rows=self.width_sample)
+
+        if self.split == 'workbook' and self.wb is not None and self._part_full(0):
+            self._new_workbook()
+        header = next(rows, None)
+        if header is None:
+            return [self._new_sheet(title, widths).title]
+        header_size = self._row_size(header)
+
+        def new_sheet(number):
+            if number > 1 and self.split == 'workbook':
+                self._new_workbook()
+            ws = self._new_sheet(title if number == 1 else f"{title[:26]}_{number}", widths)
+            self.rows_in_part += 1
+            self.bytes_in_part += header_size
+            return ws
+
+        # Заголовок txt - обычная строка, как в исходной выгрузке
+        sheets = RolloverSheets(header, max_rows=self.max_rows, header_font=None, create_sheet=new_sheet)
+        sheets.new_sheet()
+        if not self.streaming:
+            widths.update(header)
+
+        for columns in rows:
+            size = self._row_size(columns)
+            sheets.append(columns, full=self._part_full(size))
+            self.rows_in_part += 1
+            self.bytes_in_part += size
+            if not self.streaming:
+                widths.update(columns)
+
+        if not self.streaming:
+            for ws in sheets.sheets:
+                widths.apply(ws)
+        return [ws.title for ws in sheets.sheets]
+
+    def close(self):
+        """Сохраняет последнюю книгу и возвращает пути ко всем сохранённым книгам."""
+        if self.wb is not None and self.sheets_in_workbook:
+            self._save()
+            self.wb = None
+        return self.saved_paths
+
+
+def iter_chunks(rows, chunksize):
+    """Разбивает поток строк на списки по chunksize строк."""
+    while True:
+        chunk = list(islice(rows, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def unique_columns(header):
+    """Имена столбцов из строки заголовка: пустые заменяются, повторы нумеруются."""
+    columns = []
+    for idx, name in enumerate(header):
+        name = name.strip() or f"column_{idx + 1}"
+        candidate, suffix = name, 1
+        while candidate in columns:
+            suffix += 1
+            candidate = f"{name}_{suffix}"
+        columns.append(candidate)
+    return columns
+
+
+def chunk_to_columns(chunk, width, file_name):
+    """Транспонирует порцию строк в список столбцов, дополняя короткие строки пустыми значениями."""
+    for row in chunk:
+        if len(row) > width:
+            raise ValueError(f"{file_name}: в строке {len(row)} полей, в заголовке {width}")
+    return [list(column) for column in zip(*(row + [''] * (width - len(row)) for row in chunk))]
+
+
+def detect_column_types(zip_ref, file_info, chunksize=PARQUET_CHUNK_ROWS):
+    """
+    Первый проход по txt: определяет заголовок и тип каждого столбца (int64, float64 или string).
+
+    Возвращает:
+    tuple: (имена столбцов, список типов pyarrow)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rows = iter_member_rows(zip_ref, file_info)
+    columns = unique_columns(next(rows, []))
+    kinds = [0] * len(columns)  # 0 - int, 1 - float, 2 - string
+
+    for chunk in iter_chunks(rows, chunksize):
+        for idx, values in enumerate(chunk_to_columns(chunk, len(columns), file_info.filename)):
+            if kinds[idx] == 2:
+                continue
+            array = pa.array(values, type=pa.string())
+            array = array.filter(pc.not_equal(array, ''))
+            if kinds[idx] == 0 and pc.all(pc.match_substring_regex(array, INT_PATTERN)).as_py() is not False:
+                continue
+            if pc.all(pc.match_substring_regex(array, FLOAT_PATTERN)).as_py() is not False:
+                kinds[idx] = 1
+            else:
+                kinds[idx] = 2
+
+    types = [(pa.int64(), pa.float64(), pa.string())[kind] for kind in kinds]
+    return columns, types
+
+
+def write_member_parquet(zip_ref, file_info, output_path, chunksize=PARQUET_CHUNK_ROWS):
+    """
+    Записывает txt из архива в Parquet потоково, порциями по chunksize строк.
+
+    Первая строка - заголовок. Типы столбцов определяются отдельным проходом
+    по архиву, пустые значения в числовых столбцах записываются как null.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    columns, types = detect_column_types(zip_ref, file_info, chunksize)
+    schema = pa.schema(list(zip(columns, types)))
+
+    rows = iter_member_rows(zip_ref, file_info)
+    next(rows, None)  # заголовок
+
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for chunk in iter_chunks(rows, chunksize):
+            arrays = []
+            for values, column_type in zip(chunk_to_columns(chunk, len(columns), file_info.filename), types):
+                array = pa.array(values, type=pa.string())
+                if column_type != pa.string():
+                    array = pc.if_else(pc.equal(array, ''), pa.scalar(None, pa.string()), array).cast(column_type)
+                arrays.append(array)
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def write_member_csv(zip_ref, file_info, output_path):
+    """Записывает txt из архива в сжатый gzip CSV потоково, строка за строкой."""
+    with gzip.open(output_path, 'wt', encoding='utf-8', newline='') as csv_file:
+        csv.writer(csv_file).writerows(iter_member_rows(zip_ref, file_info))
+
+
+def sheet_title(file_name):
+    """Имя листа из имени txt: без папок и расширения, без недопустимых символов, до 30 символов."""
+    title = os.path.splitext(os.path.basename(file_name))[0]
+    return re.sub(r'[\\/*?:\[\]]', '_', title)[:30]
+
+
+def unique_name(name, used):
+    """name, если оно ещё не занято (без учёта регистра), иначе name_2, name_3, ...; результат добавляется в used."""
+    candidate, number = name, 1
+    while candidate.lower() in used:
+        number += 1
+        candidate = f"{name}_{number}"
+    used.add(candidate.lower())
+    return candidate
+
+
+def convert_zip(zip_path, output_dir=None, streaming=False, width_sample=None, output_format='xlsx',
+                split='sheet', max_rows=EXCEL_MAX_ROWS, max_bytes=None):
+    """
+    Конвертирует все txt одного архива.
+
+    xlsx - листы одной книги {zip_name}.xlsx, сохраняемой один раз
+    (при превышении лимита - дополнительные листы или книги, см. XlsxParts);
+    csv.gz и parquet - по файлу {zip_name}.{txt_name}.<формат> на каждый txt
+    (одноимённые txt из разных папок - {txt_name}_2, {txt_name}_3, ...),
+    строки пишутся потоково, минуя Excel.
+
+    Параметры:
+    zip_path (str): Путь к архиву
+    output_dir (str): Папка для результата (по умолчанию - папка архива)
+    streaming (bool): Потоковое чтение txt и запись write-only книги
+    width_sample (int): По скольким первым строкам подбирать ширину столбцов
+    output_format (str): Формат результата из OUTPUT_FORMATS
+    split (str): Чем продолжать при превышении лимита: 'sheet' или 'workbook'
+    max_rows (int): Лимит строк на часть (не больше EXCEL_MAX_ROWS)
+    max_bytes (int): Лимит объёма исходного текста на часть
+
+    Возвращает:
+    list: Пути к сохранённым файлам (пустой, если txt в архиве нет или архив повреждён)
+    """
+    zip_file = os.path.basename(zip_path)
+    zip_name = os.path.splitext(zip_file)[0]
+    output_dir = output_dir or os.path.dirname(zip_path)
+
+    parts = XlsxParts(output_dir, zip_name, streaming=streaming, width_sample=width_sample, split=split,
+                      max_rows=max_rows, max_bytes=max_bytes)
+    saved_paths = []
+    member_names = set()
+
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            for file_info in zip_ref.infolist():
+                if file_info.filename.endswith('.txt') and not file_info.is_dir():
+                    if output_format != 'xlsx':
+                        member_name = unique_name(sheet_title(file_info.filename), member_names)
+                        member_path = os.path.join(output_dir, f"{zip_name}.{member_name}.{output_format}")
+                        try:
+                            if output_format == 'parquet':
+                                write_member_parquet(zip_ref, file_info, member_path)
+                            else:
+                                write_member_csv(zip_ref, file_info, member_path)
+                        except ValueError as e:
+                            print(f"Ошибка: {e}")
+                            continue
+                        saved_paths.append(member_path)
+                        print(f"Данные из {file_info.filename} сохранены в {member_path}")
+                        continue
+
+                    rows = (iter_member_rows if streaming else read_member_rows)(zip_ref, file_info)
+                    titles = parts.add_member(sheet_title(file_info.filename), rows)
+                    print(f"Данные из {file_info.filename} добавлены на лист {', '.join(titles)}")
+
+    except zipfile.BadZipFile:
+        print(f"Ошибка: файл {zip_file} не является ZIP-архивом или поврежден")
+        return saved_paths
+
+    return saved_paths + parts.close()
+
+
+def process_zip_files(folder=None, streaming=False, width_sample=None, jobs=1, output_format='xlsx',
+                      split='sheet', max_rows=EXCEL_MAX_ROWS, max_bytes=None, profiler=None):
+    """
+    Конвертирует все zip-архивы папки (по умолчанию - папки скрипта).
+
+    Каждый архив конвертируется отдельно (см. convert_zip), архивы
+    обрабатываются параллельно в пуле из jobs процессов (0 - по числу ядер).
+    С profiler (StageProfiler) каждый архив профилируется отдельным этапом;
+    при параллельной обработке профилируется только ожидание пула.
+
+    Возвращает:
+    list: Пути к сохранённым файлам в порядке архивов
+    """
+    folder = folder or os.path.dirname(os.path.abspath(__file__))
+    zip_paths = [os.path.join(folder, zip_file) for zip_file in sorted(os.listdir(folder))
+                 if zip_file.endswith('.zip')]
+
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    convert = partial(convert_zip, streaming=streaming, width_sample=width_sample, output_format=output_format,
+                      split=split, max_rows=max_rows, max_bytes=max_bytes)
+
+    if jobs <= 1 or len(zip_paths) <= 1:
+        results = []
+        for zip_path in zip_paths:
+            with profiled(profiler, os.path.basename(zip_path)):
+                results.append(convert(zip_path))
+    else:
+        with profiled(profiler, "process_pool"), ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(convert, zip_paths))
+
+    return [path for paths in results for path in paths]
 
 
 def get_column_letter(col_idx):
@@ -57,4 +423,32 @@ def get_column_letter(col_idx):
 
 
 if __name__ == "__main__":
-    process_zip_files()
+    parser = argparse.ArgumentParser(description="Конвертация txt из zip-архивов в xlsx, csv.gz или parquet")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default='xlsx',
+                        help="Формат результата: xlsx (по умолчанию), csv.gz или parquet - потоково, без Excel")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Потоковое чтение txt и запись write-only книги (для выгрузок в несколько ГБ)")
+    parser.add_argument("--width-sample", type=int, default=None,
+                        help=f"Подбирать ширину столбцов по первым N строкам "
+                             f"(по умолчанию - все строки, в потоковом режиме - {WIDTH_SAMPLE_ROWS})")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Количество процессов для параллельной обработки архивов (0 - по числу ядер)")
+    parser.add_argument("--folder", default=None, help="Папка с архивами (по умолчанию - папка скрипта)")
+    parser.add_argument("--split", choices=('sheet', 'workbook'), default='sheet',
+                        help="При превышении лимита продолжать на новом листе или в новой книге {архив}_N.xlsx")
+    parser.add_argument("--max-rows", type=int, default=EXCEL_MAX_ROWS,
+                        help=f"Лимит строк на часть, включая заголовок (не больше {EXCEL_MAX_ROWS})")
+    parser.add_argument("--max-bytes", type=int, default=None,
+                        help="Лимит объёма исходного текста на часть, байт")
+    parser.add_argument("--profile", metavar="DIR", default=None,
+                        help="Профилировать обработку архивов (cProfile + tracemalloc): профили и сводка в папку DIR")
+    parser.add_argument("--profile-top", type=int, default=20, help="Сколько горячих точек выводить в сводке")
+    args = parser.parse_args()
+    profiler = StageProfiler(args.profile, top=args.profile_top) if args.profile else None
+
+    process_zip_files(folder=args.folder, streaming=args.streaming, width_sample=args.width_sample, jobs=args.jobs,
+                      output_format=args.format, split=args.split, max_rows=args.max_rows, max_bytes=args.max_bytes,
+                      profiler=profiler)
+
+    if profiler:
+        profiler.close()